@@ -0,0 +1,414 @@
+"""
+姿勢データの解析 - デバイスごとの直近サンプル履歴（NumPy）、区間統計、多段ロールアップ、
+グラフ描画用の間引き（LTTB・最小/最大包絡線）
+
+角度は Sample と同じ 1/100 度の整数で保持し、統計は度で返す。
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from kiriri_recorder import read_recording
+
+# ================== リングバッファ ==================
+class SampleRingBuffer:
+    """固定容量のサンプル履歴
+
+    各列を容量の2倍で確保し、同じ値を2か所に書く（ミラー書き込み）。
+    これにより直近 n 件（n <= capacity）は常に連続した領域になり、
+    コピーなしのビューとして取り出せる。追加は O(1)。
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity は1以上にしてください")
+        self.capacity = capacity
+        self.count = 0
+        self._head = 0  # 次に書く位置（0 <= head < capacity）
+        self._timestamps = np.zeros(2 * capacity, dtype=np.float64)
+        self._y = np.zeros(2 * capacity, dtype=np.int32)
+        self._x = np.zeros(2 * capacity, dtype=np.int32)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp: float, y: int, x: int):
+        """1サンプル追加"""
+        i = self._head
+        j = i + self.capacity
+        self._timestamps[i] = self._timestamps[j] = timestamp
+        self._y[i] = self._y[j] = y
+        self._x[i] = self._x[j] = x
+        self._head = i + 1 if i + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def extend(self, timestamps, y, x):
+        """配列でまとめて追加（容量を超える分は古い方を捨てる）"""
+        n = len(timestamps)
+        if n > self.capacity:
+            timestamps, y, x = timestamps[-self.capacity:], y[-self.capacity:], x[-self.capacity:]
+            n = self.capacity
+
+        written = 0
+        while written < n:
+            i = self._head
+            chunk = min(n - written, self.capacity - i)
+            source = slice(written, written + chunk)
+            for column, values in ((self._timestamps, timestamps), (self._y, y), (self._x, x)):
+                column[i:i + chunk] = values[source]
+                column[i + self.capacity:i + self.capacity + chunk] = values[source]
+            self._head = (i + chunk) % self.capacity
+            written += chunk
+        self.count = min(self.count + n, self.capacity)
+
+    def last(self, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """直近 n 件（省略時は全件）の (timestamps, y, x) ビュー（古い順）"""
+        n = self.count if n is None else max(0, min(n, self.count))
+        end = self._head + self.capacity
+        window = slice(end - n, end)
+        return self._timestamps[window], self._y[window], self._x[window]
+
+    def since(self, seconds: float, now: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """直近 seconds 秒の (timestamps, y, x) ビュー"""
+        timestamps, y, x = self.last()
+        if not len(timestamps):
+            return timestamps, y, x
+        cutoff = (timestamps[-1] if now is None else now) - seconds
+        start = int(np.searchsorted(timestamps, cutoff, side="left"))
+        return timestamps[start:], y[start:], x[start:]
+
+# ================== 区間統計 ==================
+def window_stats(timestamps: np.ndarray, y: np.ndarray, x: np.ndarray,
+                 reference: Optional[Tuple[float, float]] = None,
+                 tolerance: Tuple[float, float] = (5.0, 3.0)) -> dict:
+    """区間の統計（度）
+
+    reference=(y, x) を渡すと、基準から tolerance=(y, x) 度未満に収まっていた
+    時間の割合 good_ratio を返す（各サンプルは次のサンプルまで続いたとみなす）。
+    """
+    count = len(timestamps)
+    result = {"count": count}
+    if count == 0:
+        return result
+
+    y_deg = y * 0.01
+    x_deg = x * 0.01
+    result["duration"] = float(timestamps[-1] - timestamps[0])
+    for name, values in (("y", y_deg), ("x", x_deg)):
+        result[name] = {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+        }
+
+    if reference is not None:
+        good = (np.abs(y_deg - reference[0]) < tolerance[0]) & (np.abs(x_deg - reference[1]) < tolerance[1])
+        durations = np.diff(timestamps)
+        total = durations.sum()
+        if total > 0:
+            result["good_ratio"] = float(durations[good[:-1]].sum() / total)
+        else:
+            result["good_ratio"] = float(good.mean())
+    return result
+
+class SampleHistory:
+    """デバイスごとのリングバッファ（受信データの出力先として使う）"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffers: Dict[str, SampleRingBuffer] = {}
+
+    def buffer(self, device_id: str) -> SampleRingBuffer:
+        """デバイスのリングバッファ（なければ作る）"""
+        buffer = self.buffers.get(device_id)
+        if buffer is None:
+            buffer = self.buffers[device_id] = SampleRingBuffer(self.capacity)
+        return buffer
+
+    def write(self, sample):
+        """1サンプル追加（Sample 互換: device_id, y, x, timestamp）"""
+        self.buffer(sample.device_id).append(sample.timestamp, sample.y, sample.x)
+
+    def stats(self, device_id: str, seconds: float,
+              reference: Optional[Tuple[float, float]] = None,
+              tolerance: Tuple[float, float] = (5.0, 3.0)) -> dict:
+        """直近 seconds 秒の統計"""
+        if device_id not in self.buffers:
+            return {"count": 0}
+        return window_stats(*self.buffers[device_id].since(seconds), reference, tolerance)
+
+# ================== 多段ロールアップ ==================
+class RollupLevel:
+    """1つの解像度の集計（バケットごとの件数・最小・最大・合計）
+
+    集計中のバケットは Python の数値で持ち、バケットが切り替わったときだけ
+    配列に書き込むので、1サンプルあたり O(1)。配列は capacity 個のリング。
+    """
+
+    def __init__(self, resolution: float, capacity: int):
+        self.resolution = resolution
+        self.capacity = capacity
+        self._ids = np.full(capacity, -1, dtype=np.int64)  # バケット番号（-1 = 空）
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._y_min = np.zeros(capacity, dtype=np.int32)
+        self._y_max = np.zeros(capacity, dtype=np.int32)
+        self._y_sum = np.zeros(capacity, dtype=np.float64)
+        self._x_min = np.zeros(capacity, dtype=np.int32)
+        self._x_max = np.zeros(capacity, dtype=np.int32)
+        self._x_sum = np.zeros(capacity, dtype=np.float64)
+
+        # 集計中のバケット
+        self._current = -1
+        self._n = 0
+        self._ymin = self._ymax = self._ysum = 0
+        self._xmin = self._xmax = self._xsum = 0
+
+    def add(self, timestamp: float, y: int, x: int):
+        """1サンプル追加"""
+        bucket = int(timestamp // self.resolution)
+        if bucket != self._current:
+            if bucket < self._current:
+                return  # 時刻が戻ったサンプルは集計しない
+            self._close()
+            self._current = bucket
+            self._n = 1
+            self._ymin = self._ymax = self._ysum = y
+            self._xmin = self._xmax = self._xsum = x
+            return
+
+        self._n += 1
+        self._ysum += y
+        self._xsum += x
+        if y < self._ymin:
+            self._ymin = y
+        elif y > self._ymax:
+            self._ymax = y
+        if x < self._xmin:
+            self._xmin = x
+        elif x > self._xmax:
+            self._xmax = x
+
+    def _close(self):
+        if self._n == 0:
+            return
+        i = self._current % self.capacity
+        self._ids[i] = self._current
+        self._count[i] = self._n
+        self._y_min[i], self._y_max[i], self._y_sum[i] = self._ymin, self._ymax, self._ysum
+        self._x_min[i], self._x_max[i], self._x_sum[i] = self._xmin, self._xmax, self._xsum
+
+    def bucket_count(self, start: float, end: float) -> int:
+        """区間を覆うバケット数"""
+        return int(end // self.resolution) - int(start // self.resolution) + 1
+
+    def covers(self, start: float) -> bool:
+        """start を含むバケットがまだ上書きされずに残っているか（保持期間は capacity × resolution）"""
+        return self._current < 0 or int(start // self.resolution) > self._current - self.capacity
+
+    def query(self, start: float, end: float) -> dict:
+        """区間内のバケット（時刻順、集計中のバケットを含む）。角度は度"""
+        first = int(start // self.resolution)
+        last = int(end // self.resolution)
+
+        selected = np.nonzero((self._ids >= first) & (self._ids <= last) & (self._ids != self._current))[0]
+        selected = selected[np.argsort(self._ids[selected])]
+        ids = self._ids[selected]
+        count = self._count[selected]
+        columns = {
+            "y_min": self._y_min[selected], "y_max": self._y_max[selected], "y_sum": self._y_sum[selected],
+            "x_min": self._x_min[selected], "x_max": self._x_max[selected], "x_sum": self._x_sum[selected],
+        }
+
+        if self._n and first <= self._current <= last:
+            ids = np.append(ids, self._current)
+            count = np.append(count, self._n)
+            for name, value in (("y_min", self._ymin), ("y_max", self._ymax), ("y_sum", self._ysum),
+                                ("x_min", self._xmin), ("x_max", self._xmax), ("x_sum", self._xsum)):
+                columns[name] = np.append(columns[name], value)
+
+        return {
+            "resolution": self.resolution,
+            "t": ids * self.resolution,
+            "count": count,
+            "y_min": columns["y_min"] * 0.01,
+            "y_max": columns["y_max"] * 0.01,
+            "y_mean": columns["y_sum"] / np.maximum(count, 1) * 0.01,
+            "x_min": columns["x_min"] * 0.01,
+            "x_max": columns["x_max"] * 0.01,
+            "x_mean": columns["x_sum"] / np.maximum(count, 1) * 0.01,
+        }
+
+class MultiResolutionRollup:
+    """1デバイス分の多段ロールアップ（例: 1秒・10秒・1分・10分）"""
+
+    def __init__(self, resolutions=(1.0, 10.0, 60.0, 600.0), capacity: int = 3600):
+        self.levels = [RollupLevel(resolution, capacity) for resolution in sorted(resolutions)]
+
+    def add(self, timestamp: float, y: int, x: int):
+        for level in self.levels:
+            level.add(timestamp, y, x)
+
+    def select_level(self, start: float, end: float, points: int) -> RollupLevel:
+        """start まで保持している段のうち、points 個以上のバケットが取れる一番粗い段
+
+        そのような段がなければ start まで保持している一番細かい段、
+        どの段も start まで届かなければ一番長く保持している（一番粗い）段。
+        """
+        covering = [level for level in self.levels if level.covers(start)]
+        if not covering:
+            return self.levels[-1]
+        for level in reversed(covering):
+            if level.bucket_count(start, end) >= points:
+                return level
+        return covering[0]
+
+    def query(self, start: float, end: float, points: int) -> dict:
+        return self.select_level(start, end, points).query(start, end)
+
+class RollupStore:
+    """デバイスごとの多段ロールアップ（受信データの出力先として使う）"""
+
+    def __init__(self, resolutions=(1.0, 10.0, 60.0, 600.0), capacity: int = 3600):
+        self.resolutions = resolutions
+        self.capacity = capacity
+        self.rollups: Dict[str, MultiResolutionRollup] = {}
+
+    def write(self, sample):
+        """1サンプル追加（Sample 互換: device_id, y, x, timestamp）"""
+        rollup = self.rollups.get(sample.device_id)
+        if rollup is None:
+            rollup = self.rollups[sample.device_id] = MultiResolutionRollup(self.resolutions, self.capacity)
+        rollup.add(sample.timestamp, sample.y, sample.x)
+
+    def query(self, device_id: str, start: float, end: float, points: int) -> Optional[dict]:
+        rollup = self.rollups.get(device_id)
+        return rollup.query(start, end, points) if rollup else None
+
+    def command_rollup(self, message: dict) -> dict:
+        """{"cmd": "rollup", "id": device_id, "start": 秒, "end": 秒, "points": 点数}
+
+        start/end は UNIX 時刻。end 省略時は現在、start 省略時は end の1時間前。
+        points は MAX_PLOT_POINTS まで。
+        """
+        end = float(message.get("end") or time.time())
+        start = float(message.get("start") or end - 3600.0)
+        points = _plot_points(message.get("points"), 500)
+        result = self.query(str(message.get("id")), start, end, points)
+        if result is None:
+            return {"ok": False, "error": "データがありません"}
+        return {"ok": True, "id": message.get("id"),
+                **{key: value.tolist() if isinstance(value, np.ndarray) else value
+                   for key, value in result.items()}}
+
+# ================== 間引き（グラフ描画用） ==================
+# クライアントが指定できる描画幅・点数の上限（LTTB はバケットごとに Python のループを回すため）
+MAX_PLOT_POINTS = 4096
+
+def _plot_points(value, default: int) -> int:
+    return max(1, min(int(value or default), MAX_PLOT_POINTS))
+
+def lttb_indices(t: np.ndarray, v: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets で残す点のインデックス
+
+    先頭と末尾は必ず残し、間を threshold - 2 個のバケットに分けて、
+    前に選んだ点と次のバケットの平均点とで作る三角形が最大になる点を選ぶ。
+    """
+    n = len(t)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    t = t.astype(np.float64)
+    v = v.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # 各バケットの平均点（次のバケットの代表として使う）
+    sums_t = np.add.reduceat(t[1:n - 1], edges[:-1] - 1)
+    sums_v = np.add.reduceat(v[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    mean_t = np.append(sums_t / sizes, t[-1])
+    mean_v = np.append(sums_v / sizes, v[-1])
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        ct, cv = mean_t[i + 1], mean_v[i + 1]
+        at, av = t[a], v[a]
+        area = np.abs((at - ct) * (v[start:end] - av) - (at - t[start:end]) * (cv - av))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def minmax_envelope(t: np.ndarray, v: np.ndarray, width: int):
+    """width 個のバケットごとの (先頭時刻, 最小, 最大)"""
+    n = len(t)
+    if n == 0:
+        return t, v, v
+    width = min(width, n)
+    starts = (np.arange(width) * n) // width
+    return t[starts], np.minimum.reduceat(v, starts), np.maximum.reduceat(v, starts)
+
+def decimate(t: np.ndarray, y: np.ndarray, x: np.ndarray, width: int, method: str = "lttb") -> dict:
+    """y/x の2系列を描画幅 width に合わせて間引く（角度は 1/100 度 → 度）
+
+    lttb:   y と x それぞれで選んだ点を合わせた共通の時刻軸（最大 2 × width 点）
+    minmax: バケットごとの最小・最大の包絡線（width 点）
+    """
+    if method == "minmax":
+        bucket_t, y_min, y_max = minmax_envelope(t, y, width)
+        _, x_min, x_max = minmax_envelope(t, x, width)
+        return {
+            "method": "minmax", "t": bucket_t,
+            "y_min": y_min * 0.01, "y_max": y_max * 0.01,
+            "x_min": x_min * 0.01, "x_max": x_max * 0.01,
+        }
+    if method != "lttb":
+        raise ValueError(f"不明な間引き方法: {method}")
+
+    indices = np.union1d(lttb_indices(t, y, width), lttb_indices(t, x, width))
+    return {"method": "lttb", "t": t[indices], "y": y[indices] * 0.01, "x": x[indices] * 0.01}
+
+def _decimate_recording(path: str, width: int, method: str) -> dict:
+    """記録ファイルを読んで間引く（スレッドプールで実行する）"""
+    t, y, x = read_recording(path)
+    return decimate(t, y, x, width, method)
+
+async def command_history(history: Optional[SampleHistory], record_dir: Optional[str], message: dict) -> dict:
+    """{"cmd": "history", "id": device_id, "seconds": 秒, "width": 点数, "method": "lttb"|"minmax", ["file": 記録ファイル名]}
+
+    file を指定すると record_dir/<id>/ の記録ファイルから、省略時は直近履歴から間引く。
+    width は MAX_PLOT_POINTS まで。
+    間引き（記録ファイルは読み込みも）はイベントループを止めないようスレッドプールで行う。
+    """
+    device_id = str(message.get("id"))
+    width = _plot_points(message.get("width"), 800)
+    method = message.get("method") or "lttb"
+
+    loop = asyncio.get_running_loop()
+    if message.get("file"):
+        if not record_dir:
+            return {"ok": False, "error": "記録が無効です"}
+        # ディレクトリ外を読ませない
+        path = os.path.join(record_dir, os.path.basename(device_id), os.path.basename(str(message["file"])))
+        if not os.path.isfile(path):
+            return {"ok": False, "error": "記録ファイルがありません"}
+        result = await loop.run_in_executor(None, _decimate_recording, path, width, method)
+    else:
+        if history is None or device_id not in history.buffers:
+            return {"ok": False, "error": "データがありません"}
+        # 履歴はイベントループ上で書き足されるので、コピーしてから渡す
+        window = history.buffers[device_id].since(float(message.get("seconds") or 600.0))
+        t, y, x = (column.copy() for column in window)
+        result = await loop.run_in_executor(None, decimate, t, y, x, width, method)
+
+    return {"ok": True, "id": device_id,
+            **{key: value.tolist() if isinstance(value, np.ndarray) else value
+               for key, value in result.items()}}
@@ -0,0 +1,189 @@
+"""
+ブリッジのベンチマーク - 通知処理パイプラインの性能を計測して JSON で出力する
+
+計測項目:
+    pipeline: handle_notification → data_callback → WebSocket購読者 のスループット、
+              サンプルごとの遅延パーセンタイル、1000サンプルあたりのCPU時間、メモリ増加量
+    reconnect: 仮想センサー（kiriri_sim）での接続後・再接続後の最初のサンプルまでの時間
+
+    python kiriri_bench.py --samples 200000 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+from kiriri_bridge import (
+    BLEConfig, BLESensorConnection, WebSocketClient, WebSocketServer, stop_logger
+)
+from kiriri_sim import SimulatedTransport, make_peripherals, simulation_config
+
+def percentiles(values: List[float], points=(50, 90, 99, 99.9)) -> dict:
+    """パーセンタイル（マイクロ秒・ミリ秒など単位は呼び出し側に合わせる）"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        result[f"p{p:g}"] = ordered[index]
+    result["max"] = ordered[-1]
+    return result
+
+def current_rss_bytes() -> int:
+    """現在の常駐メモリ（Linux は /proc、それ以外は最大値で代用、Windows など取れない環境では 0）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource  # POSIX のみ
+    except ImportError:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+# ================== パイプライン ==================
+class _RecordingWebSocket:
+    """送信時刻だけを記録する購読者"""
+
+    def __init__(self, received: List[float]):
+        self.received = received
+        self.remote_address = ("bench", 0)
+
+    async def send(self, message):
+        self.received.append(time.perf_counter())
+
+async def bench_pipeline(samples: int, burst: int) -> dict:
+    """合成通知を handle_notification に流し込んで計測"""
+    config = BLEConfig(log_file=None, log_level="WARNING", websocket_client_queue_size=samples)
+    server = WebSocketServer(config)
+
+    sent_at: List[float] = []
+    callback_at: List[float] = []
+    received_at: List[float] = []
+
+    def callback(sample, sender):
+        callback_at.append(time.perf_counter())
+        server.publish(sample)
+
+    conn = BLESensorConnection(config, data_callback=callback)
+    conn.device_id = "BENCH"
+
+    client = WebSocketClient(_RecordingWebSocket(received_at), config.websocket_client_queue_size)
+    server.clients.add(client)
+    sender_task = asyncio.create_task(client.send_loop())
+
+    payloads = [bytearray(f"N:{i % 9000 - 4500}:{i % 3000 - 1500}\r\n".encode()) for i in range(1000)]
+    handle = conn.handle_notification
+
+    rss_before = current_rss_bytes()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+
+    for start in range(0, samples, burst):
+        for i in range(start, min(start + burst, samples)):
+            sent_at.append(time.perf_counter())
+            handle(None, payloads[i % 1000])
+        # 購読者の送信ループを動かす
+        await asyncio.sleep(0)
+
+    while len(received_at) < samples and not sender_task.done():
+        await asyncio.sleep(0)
+
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    rss_after = current_rss_bytes()
+    sender_task.cancel()
+
+    to_callback = [(c - s) * 1e6 for s, c in zip(sent_at, callback_at)]
+    to_subscriber = [(r - s) * 1e6 for s, r in zip(sent_at, received_at)]
+
+    return {
+        "samples": samples,
+        "burst": burst,
+        "delivered": len(received_at),
+        "throughput_per_sec": samples / wall,
+        "cpu_ms_per_1k_samples": cpu * 1000.0 / (samples / 1000.0),
+        "memory_growth_bytes": rss_after - rss_before,
+        "latency_us_to_callback": percentiles(to_callback),
+        "latency_us_to_subscriber": percentiles(to_subscriber),
+        "parse_errors": conn.stats["parse_errors"],
+    }
+
+# ================== 再接続 ==================
+async def bench_reconnect(reconnects: int, downtime: float) -> dict:
+    """仮想センサーで接続・再接続から最初のサンプルまでの時間を計測"""
+    peripherals = make_peripherals(1, rate_hz=50.0)
+    config = simulation_config(peripherals)
+    first_sample = asyncio.Event()
+
+    def callback(sample, sender):
+        first_sample.set()
+
+    conn = BLESensorConnection(
+        config, data_callback=callback, transport=SimulatedTransport(config, peripherals)
+    )
+
+    started = time.perf_counter()
+    run_task = asyncio.create_task(conn.run())
+    await first_sample.wait()
+    connect_latency = time.perf_counter() - started
+
+    reconnect_latencies = []
+    for _ in range(reconnects):
+        await asyncio.sleep(0.2)
+        first_sample.clear()
+        dropped = time.perf_counter()
+        conn.client.drop(downtime)
+        await first_sample.wait()
+        reconnect_latencies.append(time.perf_counter() - dropped)
+
+    await conn.stop()
+    run_task.cancel()
+
+    return {
+        "time_to_first_sample_ms": connect_latency * 1000.0,
+        "reconnects": reconnects,
+        "downtime_ms": downtime * 1000.0,
+        "time_to_first_sample_after_reconnect_ms": percentiles(
+            [latency * 1000.0 for latency in reconnect_latencies], points=(50, 90)
+        ),
+    }
+
+# ================== メイン ==================
+async def main():
+    parser = argparse.ArgumentParser(description="ブリッジの通知処理ベンチマーク")
+    parser.add_argument("--samples", type=int, default=100000, help="合成通知数")
+    parser.add_argument("--burst", type=int, default=100, help="イベントループに戻るまでの通知数")
+    parser.add_argument("--reconnects", type=int, default=5, help="再接続の計測回数 (0 で省略)")
+    parser.add_argument("--downtime", type=float, default=0.0, help="再接続計測でのリンク断の長さ (秒)")
+    parser.add_argument("--output", help="結果JSONの出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pipeline": await bench_pipeline(args.samples, args.burst),
+    }
+    if args.reconnects > 0:
+        result["reconnect"] = await bench_reconnect(args.reconnects, args.downtime)
+
+    stop_logger()
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,18 +4,52 @@ BLE センサー接続プログラム - GATT Server切断エラー対応版
 """
 
 import asyncio
+import atexit
+import inspect
+import json
 import logging
+import os
+import queue
+import re
+import struct
 import sys
+import threading
 import time
 import platform
+from array import array
 from datetime import datetime
-from typing import Optional, Callable
-from dataclasses import dataclass
+from typing import Optional, Callable, Dict, NamedTuple, Awaitable, Union
+from dataclasses import dataclass, replace
 from enum import Enum
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 
 from bleak import BleakScanner, BleakClient, BleakError
 from bleak.backends.scanner import AdvertisementData
 
+try:
+    import websockets
+except ImportError:  # WebSocket配信を使わない場合は不要
+    websockets = None
+
+try:
+    from kiriri_analytics import RollupStore, SampleHistory, command_history
+except ImportError:  # numpy がない場合は履歴・解析を無効にする
+    RollupStore = SampleHistory = command_history = None
+
+try:
+    from kiriri_shm import SampleBus
+except ImportError:  # numpy がない場合は共有メモリのバスを無効にする
+    SampleBus = None
+
+from kiriri_metrics import (
+    DURATION_BUCKETS, LATENCY_BUCKETS, Histogram, LoopLagMonitor, MetricsServer, MetricsWriter
+)
+from kiriri_posture import PostureEngine
+from kiriri_recorder import SampleRecorder
+
 # ================== 設定 ==================
 @dataclass
 class BLEConfig:
@@ -28,6 +62,7 @@ class BLEConfig:
     # 接続設定（GATTエラー対策で長めに設定）
     connection_timeout: float = 30.0
     scan_timeout: float = 15.0
+    scan_collect_window: float = 0.0  # 最初の発見後もRSSI比較のためにスキャンを続ける時間（0 = 即終了）
     initial_connection_wait: float = 5.0  # 初回接続時の待機時間を長く
     service_discovery_wait: float = 3.0   # サービスディスカバリー前の待機時間
     post_discovery_wait: float = 2.0      # サービスディスカバリー後の待機時間
@@ -41,14 +76,90 @@ class BLEConfig:
     keepalive_enabled: bool = True
     keepalive_interval: float = 20.0  # 間隔を長めに
     keepalive_command: bytes = b'PING\n'
+    keepalive_idle_threshold: float = 2.0  # 受信がこの秒数途絶えたときだけキープアライブを送る
+    keepalive_stall_intervals: int = 5     # 受信が idle_threshold × この回数途絶えたら停止とみなして切断（0 で無効）
+    
+    # リンク品質設定（受信間隔の統計とスコア）
+    link_health_alpha: float = 0.05      # 移動平均（EWMA）の係数
+    link_health_gap_factor: float = 3.0  # 平均間隔のこの倍以上空いたら欠落とみなす
+    link_health_warmup: int = 100        # スコアを使い始めるまでの受信数
+    link_health_min_score: float = 0.0   # スコアがこれを下回ったら再接続（0 で無効）
     
     # エラーリトライ設定
     gatt_error_retry_delay: float = 15.0  # GATTエラー時の待機時間
     service_discovery_retry: int = 3       # サービスディスカバリーの再試行回数
+    gatt_cache_file: Optional[str] = "kiriri_gatt_cache.json"  # GATTハンドルのキャッシュ（None で無効）
+    
+    # 高速再接続設定
+    fast_reconnect: bool = True          # 前回のデバイスへスキャンせずに直接再接続
+    fast_reconnect_delay: float = 0.5    # 正常だった接続が切れた後の再接続待機
+    direct_connect_timeout: float = 5.0  # 直接再接続のタイムアウト（失敗したらスキャンに戻る）
+    adaptive_settle: bool = True         # 準備ができ次第、固定待機を打ち切る（GATTエラー後は固定待機）
+    settle_poll_interval: float = 0.05   # 準備完了の確認間隔
+    
+    # データコールバック設定
+    callback_workers: int = 0               # 同期コールバック用スレッド数（0 = イベントループ上で直接呼ぶ。
+                                            # スレッドセーフな独自コールバック向けで、main の出力先には使えない）
+    callback_queue_size: int = 1024         # スレッドプール・非同期コールバックの待ち上限
+    callback_overflow: str = "drop_oldest"  # 溢れたとき: drop_oldest / drop_newest / block
+    callback_block_timeout: float = 0.1     # block 時に空きを待つ最大時間（超えたら新しい方を破棄）
+    
+    # まとめ配送設定
+    batch_max_size: int = 0                 # 1回の配送にまとめる最大サンプル数（0 = サンプルごとに配送）
+    batch_max_latency_ms: float = 20.0      # 最初のサンプルから配送までの最大遅延
+    
+    # 複数センサー設定
+    max_connections: int = 7          # 同時接続数の上限（アダプターの接続スロット数）
+    rescan_interval: float = 30.0     # 未接続センサーを探す共有スキャンの間隔
+    
+    # 複数プロセス設定（kiriri_supervisor.py：アダプター・デバイス群ごとのワーカープロセス）
+    worker_ring_capacity: int = 65536     # ワーカーごとの共有メモリリングのサンプル数
+    worker_poll_interval: float = 0.005   # 集約側がリングを読む間隔（秒）
+    worker_restart_delay: float = 5.0     # 落ちたワーカーを再起動するまでの待機
+    
+    # WebSocket配信設定（pairing_test.js の connectWebSocket() 用）
+    websocket_enabled: bool = True
+    websocket_host: str = "localhost"
+    websocket_port: int = 8765
+    websocket_client_queue_size: int = 256  # クライアントごとの送信キュー上限（超えたら古いものから破棄）
+    websocket_frame_interval: float = 0.05  # バイナリ形式でサンプルをまとめて送る間隔（秒）
+    websocket_frame_max_samples: int = 1024  # バイナリ形式の1フレームあたりの最大サンプル数
+    
+    # メトリクス設定（Prometheus 形式、kiriri_metrics.py）
+    metrics_enabled: bool = True
+    metrics_host: str = "localhost"
+    metrics_port: int = 9108
+    
+    # イベントループ設定
+    event_loop: str = "asyncio"        # "uvloop" で uvloop を使う（Linux/macOS、未インストールなら asyncio）
+    loop_lag_interval: float = 0.1     # ループの遅れを測る間隔（秒、0 で無効）
+    loop_lag_budget_ms: float = 50.0   # この遅れを超えたら警告
+    
+    # セッション記録設定（列指向バイナリ、kiriri_recorder.py）
+    record_dir: Optional[str] = None        # 記録先ディレクトリ（None で記録しない）
+    record_batch_size: int = 256            # 1ブロックにまとめるサンプル数
+    record_flush_interval: float = 1.0      # バッチが溜まらなくても書き込む間隔（秒）
+    record_rotate_bytes: int = 64 * 1024 * 1024  # このサイズを超えたら次のファイルへ
+    record_rotate_seconds: float = 3600.0   # この時間を超えたら次のファイルへ
+    
+    # 直近履歴設定（NumPyリングバッファ、kiriri_analytics.py）
+    history_capacity: int = 180000          # デバイスごとの保持サンプル数（50Hzで1時間、0 で無効）
+    rollup_resolutions: tuple = (1.0, 10.0, 60.0, 600.0)  # 長時間表示用の集計解像度（秒、空で無効）
+    rollup_capacity: int = 3600             # 解像度ごとの保持バケット数
+    
+    # 共有メモリのサンプルバス設定（同じホストのほかのプロセス向け、kiriri_shm.py）
+    shm_bus_enabled: bool = False
+    shm_bus_prefix: str = "kiriri"          # リング名は "<prefix>-<デバイス名>"
+    shm_bus_capacity: int = 65536           # デバイスごとのリングのサンプル数
+    
+    # 姿勢判定設定（kiriri_posture.py）
+    posture_enabled: bool = True
+    posture_file: Optional[str] = "kiriri_posture.json"  # 基準姿勢・ユーザー別閾値の保存先
     
     # ログ設定
     log_level: str = "INFO"
     log_file: Optional[str] = "ble_sensor_service.log"
+    data_log_interval: float = 1.0  # 受信データログの最小間隔（秒）。0 = 毎回, 負 = 出力しない
     
     def __post_init__(self):
         if self.target_device_names is None:
@@ -62,12 +173,84 @@ class ConnectionState(Enum):
     CONNECTED = "接続済み"
     ERROR = "エラー"
 
+# ================== 受信データ ==================
+class Sample(NamedTuple):
+    """解析済みの1サンプル（角度は 1/100 度単位の整数）"""
+    device_id: str
+    y: int
+    x: int
+    timestamp: float  # 受信時刻 (time.time())
+
+class SampleBatch:
+    """まとめて配送するサンプル列（容量分を事前確保した配列）
+    
+    timestamps / y / x の先頭 count 件が有効。イテレートすると Sample を返す。
+    """
+    __slots__ = ("device_id", "count", "timestamps", "y", "x")
+    
+    def __init__(self, device_id: str, capacity: int):
+        self.device_id = device_id
+        self.count = 0
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.y = array("i", bytes(4 * capacity))
+        self.x = array("i", bytes(4 * capacity))
+    
+    def __len__(self):
+        return self.count
+    
+    def __iter__(self):
+        device_id = self.device_id
+        for i in range(self.count):
+            yield Sample(device_id, self.y[i], self.x[i], self.timestamps[i])
+
+# "N:<y*100>:<x*100>" をバイト列のまま解析する（str を作らない）
+_SAMPLE_PATTERN = re.compile(rb"N:(-?\d+):(-?\d+)")
+
+def parse_sample(data: bytes, device_id: str, timestamp: float) -> Optional[Sample]:
+    """通知ペイロードを Sample に変換（形式が違えば None）"""
+    match = _SAMPLE_PATTERN.search(data)
+    if match is None:
+        return None
+    return Sample(device_id, int(match.group(1)), int(match.group(2)), timestamp)
+
 # ================== ロギング設定 ==================
-def setup_logger(config: BLEConfig) -> logging.Logger:
-    """ロガーのセットアップ"""
+class _DeferredQueueHandler(QueueHandler):
+    """レコードを整形せずにキューへ入れるハンドラー
+    
+    標準の QueueHandler は呼び出し側スレッドでメッセージを整形するため、
+    整形もファイル出力も QueueListener のスレッドに任せる。
+    """
+    
+    def prepare(self, record):
+        return record
+
+class _LogTimestamp:
+    """ログ出力時に初めて整形される時刻"""
+    __slots__ = ("value",)
+    
+    def __init__(self, value: float):
+        self.value = value
+    
+    def __str__(self):
+        return datetime.fromtimestamp(self.value).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+_log_listener: Optional[QueueListener] = None
+
+def setup_logger(config: BLEConfig, name: Optional[str] = None) -> logging.Logger:
+    """ロガーのセットアップ（name を渡すとデバイス別の子ロガーを返す）
+    
+    イベントループ側はキューに積むだけで、整形とファイル書き込みは
+    バックグラウンドスレッド（QueueListener）で行う。
+    """
+    global _log_listener
+    
     logger = logging.getLogger("BLESensor")
     logger.setLevel(getattr(logging, config.log_level))
     
+    # 複数接続で同じハンドラーを重複登録しない
+    if logger.handlers:
+        return logger.getChild(name) if name else logger
+    
     # フォーマッター
     formatter = logging.Formatter(
         '%(asctime)s.%(msecs)03d [%(levelname)s] %(message)s',
@@ -77,29 +260,387 @@ def setup_logger(config: BLEConfig) -> logging.Logger:
     # コンソールハンドラー
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # ファイルハンドラー
     if config.log_file:
         file_handler = logging.FileHandler(config.log_file, encoding='utf-8')
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    # キュー経由でバックグラウンドスレッドに出力させる
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(stop_logger)
     
-    return logger
+    return logger.getChild(name) if name else logger
+
+def stop_logger():
+    """キューに残ったログを書き出してバックグラウンドスレッドを止める"""
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+# ================== GATTキャッシュ ==================
+def advertisement_fingerprint(device, advertisement_data: Optional[AdvertisementData]) -> str:
+    """アドバタイズ内容からファームウェアの違いを見分けるための指紋"""
+    parts = [device.name or ""]
+    if advertisement_data is not None:
+        parts.extend(sorted(uuid.lower() for uuid in advertisement_data.service_uuids))
+        parts.extend(str(company_id) for company_id in sorted(advertisement_data.manufacturer_data))
+    return "|".join(parts)
+
+class GattCache:
+    """デバイスアドレスごとに解決済みのサービス・特性ハンドルを保存するディスクキャッシュ
+    
+    エントリ: {"fingerprint": str, "service_uuid": str, "characteristics": {uuid: handle}}
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def get(self, address: str, fingerprint: str) -> Optional[dict]:
+        """指紋が一致するエントリを返す（不一致なら無効化）"""
+        entry = self.entries.get(address)
+        if entry is None:
+            return None
+        if entry.get("fingerprint") != fingerprint:
+            self.invalidate(address)
+            return None
+        return entry
+    
+    def put(self, address: str, fingerprint: str, service_uuid: str, characteristics: Dict[str, int]):
+        """エントリを保存"""
+        self.entries[address] = {
+            "fingerprint": fingerprint,
+            "service_uuid": service_uuid,
+            "characteristics": characteristics,
+        }
+        self.save()
+    
+    def invalidate(self, address: str):
+        """エントリを削除"""
+        if self.entries.pop(address, None) is not None:
+            self.save()
+    
+    def save(self):
+        """途中で落ちても壊れないように一時ファイル経由で書き込む"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+_gatt_caches: Dict[str, GattCache] = {}
+
+def get_gatt_cache(path: Optional[str]) -> Optional[GattCache]:
+    """同じファイルのキャッシュは接続間で共有する"""
+    if not path:
+        return None
+    if path not in _gatt_caches:
+        _gatt_caches[path] = GattCache(path)
+    return _gatt_caches[path]
+
+# ================== トランスポート ==================
+class BleakTransport:
+    """bleak を使う実機用トランスポート
+    
+    BLESensorConnection はスキャナーとクライアントをトランスポート経由で作るため、
+    同じインターフェースを持つ別実装（kiriri_sim.SimulatedTransport など）に差し替えられる。
+    """
+    
+    def __init__(self, adapter: Optional[str] = None):
+        self.adapter = adapter  # 例: "hci0"（None = 既定のアダプター）
+    
+    def _adapter_kwargs(self) -> dict:
+        return {"adapter": self.adapter} if self.adapter else {}
+    
+    def create_scanner(self, detection_callback: Callable):
+        """スキャナーを作成（start()/stop() を持つ）"""
+        return BleakScanner(detection_callback, **self._adapter_kwargs())
+    
+    def create_client(self, device, **kwargs):
+        """クライアントを作成（BleakClient 互換）"""
+        return BleakClient(device, **kwargs, **self._adapter_kwargs())
+
+# ================== スキャン ==================
+def matches_target(config: BLEConfig, name: Optional[str]) -> bool:
+    """デバイス名が対象かどうか"""
+    return bool(name) and any(target in name for target in config.target_device_names)
+
+async def scan_for_devices(config: BLEConfig, expected: int = 1, exclude=(),
+                           transport: Optional[BleakTransport] = None, held_names=None) -> list:
+    """対象デバイスをスキャンし、(device, advertisement_data) を RSSI の強い順に返す
+    
+    expected 台見つかった時点でスキャンを打ち切る（scan_timeout まで待たない）。
+    held_names（接続済みのデバイス名）を渡すと、対象名がすべて接続済みか今回の発見と
+    完全一致した時点でも打ち切る。部分一致の対象名は何台あるかわからないので打ち切らない。
+    scan_collect_window を設定すると、最初の発見からその時間だけは集め続ける。
+    """
+    loop = asyncio.get_running_loop()
+    found = {}  # アドレス -> (device, advertisement_data)
+    enough = asyncio.Event()
+    first_hit_time = None
+    # 完全一致でまだ見つかっていない対象名
+    unseen = None if held_names is None else set(config.target_device_names) - set(held_names)
+    
+    def detection_callback(device, advertisement_data: AdvertisementData):
+        nonlocal first_hit_time
+        if device.address in exclude or not matches_target(config, device.name):
+            return
+        
+        previous = found.get(device.address)
+        if previous is None or advertisement_data.rssi > previous[1].rssi:
+            found[device.address] = (device, advertisement_data)
+        
+        if first_hit_time is None:
+            first_hit_time = loop.time()
+        if unseen is not None:
+            unseen.discard(device.name)
+        if len(found) >= expected or unseen == set():
+            enough.set()
+    
+    # コールバック形式でスキャン（より安定）
+    scanner = (transport or BleakTransport()).create_scanner(detection_callback)
+    deadline = loop.time() + config.scan_timeout
+    await scanner.start()
+    try:
+        try:
+            await asyncio.wait_for(enough.wait(), config.scan_timeout)
+        except asyncio.TimeoutError:
+            pass
+        
+        # RSSI比較のための収集時間
+        if first_hit_time is not None and config.scan_collect_window > 0:
+            remaining = min(first_hit_time + config.scan_collect_window, deadline) - loop.time()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+    finally:
+        await scanner.stop()
+    
+    return sorted(found.values(), key=lambda item: item[1].rssi, reverse=True)
+
+# ================== コールバック配送 ==================
+class CallbackDispatcher:
+    """同期コールバックをスレッドプールで実行する上限付きキュー
+    
+    イベントループ側は submit() で積むだけ。キューが溢れたときの扱いは overflow で選ぶ:
+        drop_oldest: 一番古いものを捨てて積む
+        drop_newest: 新しいものを捨てる
+        block:       block_timeout まで空きを待つ（イベントループも止まる）。それでも空かなければ新しいものを捨てる
+    """
+    
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+    
+    def __init__(self, callback: Callable, workers: int, queue_size: int, overflow: str,
+                 block_timeout: float, stats: dict, logger: logging.Logger):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"不明な callback_overflow: {overflow}")
+        
+        self.callback = callback
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.stats = stats
+        self.logger = logger
+        
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        
+        self.stats["callback_queue_depth"] = 0
+        self.stats["callback_dropped"] = 0
+        
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kiriri-callback")
+        for _ in range(workers):
+            self._executor.submit(self._worker)
+    
+    def submit(self, *args):
+        """引数をキューに積む（ブロックするのは overflow="block" のときだけ）"""
+        with self._condition:
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self.stats["callback_dropped"] += 1
+                elif self.overflow == "block":
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self.queue_size, self.block_timeout
+                    )
+                if len(self._queue) >= self.queue_size:
+                    self.stats["callback_dropped"] += 1
+                    return
+            
+            self._queue.append(args)
+            self.stats["callback_queue_depth"] = len(self._queue)
+            self._condition.notify_all()
+    
+    def _worker(self):
+        """キューから取り出してコールバックを実行"""
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                args = self._queue.popleft()
+                self.stats["callback_queue_depth"] = len(self._queue)
+                self._condition.notify_all()
+            
+            try:
+                self.callback(*args)
+            except Exception as e:
+                self.logger.error(f"コールバックエラー: {e}")
+    
+    def close(self):
+        """残りを処理してからスレッドを止める（待たない）"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=False)
+
+# ================== リンク品質 ==================
+class LinkHealth:
+    """受信間隔の移動統計によるリンク品質（デバイスあたり O(1) メモリ）
+    
+    burst_window 未満の間隔で届いた通知は同じ接続イベントの一括配信とみなしてまとめ、
+    受信間隔は「前の配信からの時間 ÷ その間のサンプル数」で測る（2件ずつ届いても間隔は 0 にならない）。
+    
+    interval: 受信間隔の指数移動平均（想定サンプル間隔、最初の seed_events 回は単純平均）
+    jitter:   平均間隔からのずれの指数移動平均
+    loss:     欠落サンプルの割合の指数移動平均（間隔から推定）
+    score = (1 - loss) × 規則性 interval / (interval + jitter) × 無通信の減衰 （0〜1）
+    """
+    __slots__ = ("alpha", "gap_factor", "burst_window", "seed_events", "samples", "events",
+                 "pending", "interval", "jitter", "loss", "gaps", "longest_gap", "last_time")
+    
+    def __init__(self, alpha: float = 0.05, gap_factor: float = 3.0,
+                 burst_window: float = 0.002, seed_events: int = 8):
+        self.alpha = alpha
+        self.gap_factor = gap_factor
+        self.burst_window = burst_window
+        self.seed_events = seed_events
+        self.reset()
+    
+    def reset(self):
+        """接続ごとにやり直す"""
+        self.samples = 0
+        self.events = 0     # 間隔を測った配信の数
+        self.pending = 0    # 前の配信に続けて届いたサンプル数
+        self.interval = 0.0
+        self.jitter = 0.0
+        self.loss = 0.0
+        self.gaps = 0
+        self.longest_gap = 0.0
+        self.last_time: Optional[float] = None
+    
+    def update(self, now: float):
+        """1サンプル受信"""
+        last = self.last_time
+        self.samples += 1
+        if last is None:
+            self.last_time = now
+            return
+        
+        delta = now - last
+        if delta < self.burst_window:
+            # 同じ配信の続き：時刻は進めず、次の間隔をこの分だけ割る
+            self.pending += 1
+            return
+        
+        self.last_time = now
+        count = self.pending + 1
+        self.pending = 0
+        per_sample = delta / count
+        self.events += 1
+        
+        if self.events <= self.seed_events:
+            # 立ち上がりは単純平均で想定間隔を決める（欠落判定はしない）
+            self.interval += (per_sample - self.interval) / self.events
+            return
+        
+        alpha = self.alpha
+        interval = self.interval
+        if delta >= interval * self.gap_factor * count:
+            # 欠落：抜けたサンプル数を損失として数え、平均間隔はゆっくりだけ追従させる
+            self.gaps += 1
+            if delta > self.longest_gap:
+                self.longest_gap = delta
+            missed = delta / interval - count
+            self.loss += alpha * (missed / (missed + count) - self.loss)
+            self.interval = interval + alpha * 0.25 * (per_sample - interval)
+            return
+        
+        self.loss -= alpha * self.loss
+        self.jitter += alpha * (abs(per_sample - interval) - self.jitter)
+        self.interval = interval + alpha * (per_sample - interval)
+    
+    def score(self, now: Optional[float] = None) -> float:
+        """リンク品質スコア（1 = 良好、0 = 不通）"""
+        if self.events <= self.seed_events or self.interval <= 0:
+            return 1.0
+        regularity = self.interval / (self.interval + self.jitter)
+        value = (1.0 - self.loss) * regularity
+        
+        # 受信が途絶えていれば時間とともに下げる
+        if now is not None and self.last_time is not None:
+            idle = now - self.last_time
+            limit = self.interval * self.gap_factor
+            if idle > limit:
+                value *= limit / idle
+        return value
+    
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        """統計と一緒に出す値"""
+        return {
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000.0, 2),
+            "jitter_ms": round(self.jitter * 1000.0, 2),
+            "loss": round(self.loss, 4),
+            "gaps": self.gaps,
+            "longest_gap_ms": round(self.longest_gap * 1000.0, 1),
+            "score": round(self.score(now if now is not None else time.time()), 3),
+        }
 
 # ================== メインクラス ==================
 class BLESensorConnection:
     """BLEセンサー接続管理"""
     
-    def __init__(self, config: BLEConfig, data_callback: Optional[Callable] = None):
+    def __init__(self, config: BLEConfig, data_callback: Optional[Callable] = None,
+                 device=None, advertisement_data: Optional[AdvertisementData] = None,
+                 transport: Optional[BleakTransport] = None):
         self.config = config
-        self.logger = setup_logger(config)
+        self.transport = transport or BleakTransport()
+        self.logger = setup_logger(config, device.name if device else None)
         self.data_callback = data_callback
         
         # 状態管理
         self.state = ConnectionState.DISCONNECTED
         self.client: Optional[BleakClient] = None
-        self.device = None
+        self.device = device
+        self.device_id = device.name if device else ""
+        self.fingerprint = advertisement_fingerprint(device, advertisement_data) if device else ""
+        
+        # GATTキャッシュと解決済みの特性（未解決の間はUUIDで指定）
+        self.gatt_cache = get_gatt_cache(config.gatt_cache_file)
+        self._notify_target = config.notify_characteristic_uuid
+        self._write_target = config.write_characteristic_uuid
+        self.disconnected_event = asyncio.Event()
+        
+        # マネージャーから渡された発見済みデバイス（初回はスキャンを省略）
+        self._initial_device = device
+        # 共有スキャンと重ならないようにするためのロック（マネージャーが設定）
+        self.scan_lock: Optional[asyncio.Lock] = None
         
         # 統計
         self.stats = {
@@ -107,30 +648,157 @@ class BLESensorConnection:
             "disconnections": 0,
             "data_received": 0,
             "last_data_time": None,
-            "gatt_errors": 0
+            "gatt_errors": 0,
+            "parse_errors": 0,
+            "keepalives": 0,
+            "stalls": 0,
+            "health_reconnects": 0
         }
+        self.health = LinkHealth(config.link_health_alpha, config.link_health_gap_factor)
+        
+        # 分布（受信から配送まで・接続・スキャンの所要時間、秒）
+        self.delivery_latency = Histogram(LATENCY_BUCKETS)
+        self.connect_duration = Histogram(DURATION_BUCKETS)
+        self.scan_duration = Histogram(DURATION_BUCKETS)
         
         # フラグ
         self.should_stop = False
         self.last_gatt_error_time = 0
+        self._use_fixed_waits = False     # GATTエラー後は固定待機に戻す
+        self._last_session_ok = False     # 前回の接続がデータ受信開始まで到達したか
         
+        # コールバックの呼び方（コルーチン→タスク、スレッドプール、直接呼び出し）
+        self._callback_tasks = set()
+        self._dispatcher: Optional[CallbackDispatcher] = None
+        self._deliver: Optional[Callable] = None
+        if data_callback is None:
+            pass
+        elif asyncio.iscoroutinefunction(data_callback):
+            self.stats["callback_pending_tasks"] = 0
+            self.stats["callback_dropped"] = 0
+            self._deliver = self._deliver_async
+        elif config.callback_workers > 0:
+            self._dispatcher = CallbackDispatcher(
+                data_callback, config.callback_workers, config.callback_queue_size,
+                config.callback_overflow, config.callback_block_timeout, self.stats, self.logger
+            )
+            self._deliver = self._dispatcher.submit
+        else:
+            self._deliver = data_callback
+        
+        # まとめ配送用のバッチ（配送後は受け手のものになるため毎回作り直す）
+        self._batch: Optional[SampleBatch] = None
+        self._batch_sender = None
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        
+        # 受信データログの間引き
+        self._next_data_log = 0.0 if config.data_log_interval >= 0 else float("inf")
+        
+    def _mark_gatt_error(self):
+        """GATTエラーを記録（回復するまで固定待機に戻す）"""
+        self.last_gatt_error_time = time.time()
+        self._use_fixed_waits = True
+        if self.gatt_cache and self.device:
+            self.gatt_cache.invalidate(self.device.address)
+    
+    def _is_connected(self) -> bool:
+        return bool(self.client and self.client.is_connected)
+    
+    def _services_ready(self) -> bool:
+        """接続済みでサービス情報が揃っているか"""
+        if not self._is_connected():
+            return False
+        try:
+            return bool(self.client.services)
+        except BleakError:
+            return False
+    
+    async def _settle(self, seconds: float, ready: Optional[Callable[[], bool]] = None):
+        """安定化待機（準備ができ次第打ち切る。GATTエラー後は固定時間待つ）"""
+        if not self.config.adaptive_settle or self._use_fixed_waits:
+            await asyncio.sleep(seconds)
+            return
+        
+        deadline = time.monotonic() + seconds
+        while ready is not None and not ready() and time.monotonic() < deadline:
+            await asyncio.sleep(self.config.settle_poll_interval)
+    
     def handle_notification(self, sender, data: bytearray):
         """データ受信ハンドラー"""
         try:
-            self.stats["last_data_time"] = time.time()
+            now = time.time()
+            self.stats["last_data_time"] = now
             self.stats["data_received"] += 1
+            self.health.update(now)
             
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-            decoded_data = data.decode(errors='ignore').strip()
+            sample = parse_sample(data, self.device_id, now)
+            if sample is None:
+                self.stats["parse_errors"] += 1
+                self.logger.debug(f"解析できないデータ: {bytes(data)!r}")
+                return
             
-            self.logger.info(f"受信データ [{timestamp}]: {decoded_data}")
+            # 受信データログは間隔を空けて出力（整形はログスレッドで行う）
+            if now >= self._next_data_log:
+                self._next_data_log = now + self.config.data_log_interval
+                self.logger.info("受信データ [%s]: N:%d:%d", _LogTimestamp(now), sample.y, sample.x)
             
-            if self.data_callback:
-                self.data_callback(decoded_data, sender)
+            if self._deliver:
+                if self.config.batch_max_size > 0:
+                    self._add_to_batch(sample, sender)
+                else:
+                    self._deliver(sample, sender)
+                    self.delivery_latency.observe(time.time() - now)
                 
         except Exception as e:
             self.logger.error(f"データ処理エラー: {e}")
     
+    def _add_to_batch(self, sample: Sample, sender):
+        """バッチに追加（満杯か最大遅延で配送）"""
+        batch = self._batch
+        if batch is None:
+            batch = self._batch = SampleBatch(self.device_id, self.config.batch_max_size)
+            self._batch_timer = asyncio.get_running_loop().call_later(
+                self.config.batch_max_latency_ms / 1000.0, self.flush_batch
+            )
+        
+        i = batch.count
+        batch.timestamps[i] = sample.timestamp
+        batch.y[i] = sample.y
+        batch.x[i] = sample.x
+        batch.count = i + 1
+        self._batch_sender = sender
+        
+        if batch.count >= self.config.batch_max_size:
+            self.flush_batch()
+    
+    def flush_batch(self):
+        """溜まっているバッチを配送"""
+        batch = self._batch
+        self._batch = None
+        if self._batch_timer:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if batch is not None and batch.count and self._deliver:
+            self._deliver(batch, self._batch_sender)
+            # バッチ内で最も待ったサンプルの遅延
+            self.delivery_latency.observe(time.time() - batch.timestamps[0])
+    
+    def _deliver_async(self, sample: Sample, sender):
+        """コルーチンのコールバックをタスクとして実行（同時実行数は上限付き）"""
+        if len(self._callback_tasks) >= self.config.callback_queue_size:
+            self.stats["callback_dropped"] += 1
+            return
+        task = asyncio.get_running_loop().create_task(self.data_callback(sample, sender))
+        self._callback_tasks.add(task)
+        self.stats["callback_pending_tasks"] = len(self._callback_tasks)
+        task.add_done_callback(self._callback_task_done)
+    
+    def _callback_task_done(self, task: asyncio.Task):
+        self._callback_tasks.discard(task)
+        self.stats["callback_pending_tasks"] = len(self._callback_tasks)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"コールバックエラー: {task.exception()}")
+    
     async def find_device(self) -> Optional[any]:
         """デバイスをスキャン（複数回試行）"""
         for attempt in range(self.config.max_scan_retry):
@@ -141,21 +809,21 @@ class BLESensorConnection:
             self.logger.info(f"デバイスをスキャン中: {', '.join(self.config.target_device_names)}")
             
             try:
-                # コールバック形式でスキャン（より安定）
-                devices = []
-                
-                def detection_callback(device, advertisement_data: AdvertisementData):
-                    if device.name and any(name in device.name for name in self.config.target_device_names):
-                        devices.append(device)
-                
-                scanner = BleakScanner(detection_callback)
-                await scanner.start()
-                await asyncio.sleep(self.config.scan_timeout)
-                await scanner.stop()
+                if self.scan_lock:
+                    async with self.scan_lock:
+                        started = time.monotonic()
+                        devices = await scan_for_devices(self.config, transport=self.transport)
+                else:
+                    started = time.monotonic()
+                    devices = await scan_for_devices(self.config, transport=self.transport)
+                self.scan_duration.observe(time.monotonic() - started)
                 
                 if devices:
-                    device = devices[0]
-                    self.logger.info(f"デバイス発見: {device.name} ({device.address})")
+                    device, advertisement_data = devices[0]
+                    self.logger.info(
+                        f"デバイス発見: {device.name} ({device.address}) RSSI {advertisement_data.rssi}"
+                    )
+                    self.fingerprint = advertisement_fingerprint(device, advertisement_data)
                     return device
                 
             except Exception as e:
@@ -167,7 +835,7 @@ class BLESensorConnection:
         self.logger.warning("デバイスが見つかりませんでした")
         return None
     
-    async def connect_with_retry(self, device) -> bool:
+    async def connect_with_retry(self, device, timeout: Optional[float] = None) -> bool:
         """接続を確立（GATTエラー対策込み）"""
         self.state = ConnectionState.CONNECTING
         
@@ -191,25 +859,39 @@ class BLESensorConnection:
             
             # 新しいクライアントを作成
             self.logger.info("接続を開始します...")
-            self.client = BleakClient(
+            self.disconnected_event.clear()
+            self._notify_target = self.config.notify_characteristic_uuid
+            self._write_target = self.config.write_characteristic_uuid
+            
+            # キャッシュ済みなら必要なサービスだけを解決させる
+            client_kwargs = {}
+            entry = self._cached_gatt(device)
+            if entry:
+                client_kwargs["services"] = [entry["service_uuid"]]
+            
+            self.client = self.transport.create_client(
                 device,
-                timeout=self.config.connection_timeout,
-                disconnected_callback=self._on_disconnect
+                timeout=timeout or self.config.connection_timeout,
+                disconnected_callback=self._on_disconnect,
+                **client_kwargs
             )
             
             # 接続試行
+            started = time.monotonic()
             await self.client.connect()
             
             if not self.client.is_connected:
                 self.logger.error("接続に失敗しました")
                 return False
+            self.connect_duration.observe(time.monotonic() - started)
             
             self.logger.info("接続成功！")
             self.stats["connections"] += 1
+            self.health.reset()
             
-            # 接続を安定させるための長めの待機
-            self.logger.info(f"接続安定化のため {self.config.initial_connection_wait} 秒待機中...")
-            await asyncio.sleep(self.config.initial_connection_wait)
+            # 接続を安定させるための待機（サービス情報が揃えば打ち切る）
+            self.logger.info(f"接続安定化のため最大 {self.config.initial_connection_wait} 秒待機中...")
+            await self._settle(self.config.initial_connection_wait, self._services_ready)
             
             return True
             
@@ -217,7 +899,7 @@ class BLESensorConnection:
             if "GATT" in str(e):
                 self.logger.error(f"GATTエラー: {e}")
                 self.stats["gatt_errors"] += 1
-                self.last_gatt_error_time = time.time()
+                self._mark_gatt_error()
             else:
                 self.logger.error(f"BLE接続エラー: {e}")
             return False
@@ -225,46 +907,90 @@ class BLESensorConnection:
             self.logger.error(f"接続エラー: {e}")
             return False
     
+    def _cached_gatt(self, device) -> Optional[dict]:
+        """このデバイスのGATTキャッシュ（指紋が一致する場合のみ）"""
+        if not self.gatt_cache:
+            return None
+        return self.gatt_cache.get(device.address, self.fingerprint)
+    
+    def _resolve_characteristics(self, services, by_handle: Optional[Dict[str, int]] = None) -> bool:
+        """書き込み・通知特性を解決（by_handle があればハンドルで照合）"""
+        resolved = {}
+        for uuid in (self.config.write_characteristic_uuid, self.config.notify_characteristic_uuid):
+            key = by_handle.get(uuid.lower()) if by_handle is not None else uuid
+            char = services.get_characteristic(key) if key is not None else None
+            if char is None or char.uuid.lower() != uuid.lower():
+                return False
+            resolved[uuid] = char
+        
+        self._write_target = resolved[self.config.write_characteristic_uuid]
+        self._notify_target = resolved[self.config.notify_characteristic_uuid]
+        return True
+    
+    def _use_gatt_cache(self) -> bool:
+        """キャッシュしたハンドルが接続後のサービス情報と一致するか確認"""
+        entry = self._cached_gatt(self.device)
+        if not entry or not self._services_ready():
+            return False
+        
+        characteristics = entry.get("characteristics", {})
+        if self._resolve_characteristics(self.client.services, by_handle=characteristics):
+            return True
+        
+        self.logger.info("GATTキャッシュが一致しないため無効化します")
+        self.gatt_cache.invalidate(self.device.address)
+        return False
+    
+    async def _get_services(self):
+        """サービス情報を取り直す"""
+        if hasattr(self.client, "get_services"):
+            # キャッシュをクリア
+            if hasattr(self.client, '_services'):
+                self.client._services = None
+            return await self.client.get_services()
+        return self.client.services
+    
     async def discover_services_with_retry(self) -> bool:
-        """サービスディスカバリー（リトライ付き）"""
+        """サービスディスカバリー（リトライ付き、GATTキャッシュが有効なら省略）"""
+        if self._use_gatt_cache():
+            self.logger.info("GATTキャッシュを使用（サービスディスカバリーを省略）")
+            return True
+        
         for attempt in range(self.config.service_discovery_retry):
             try:
                 if attempt > 0:
                     self.logger.info(f"サービスディスカバリー再試行 {attempt + 1}/{self.config.service_discovery_retry}")
                 
                 # ディスカバリー前の待機
-                self.logger.info(f"サービスディスカバリー前に {self.config.service_discovery_wait} 秒待機...")
-                await asyncio.sleep(self.config.service_discovery_wait)
+                self.logger.info(f"サービスディスカバリー前に最大 {self.config.service_discovery_wait} 秒待機...")
+                await self._settle(self.config.service_discovery_wait, self._services_ready)
                 
                 # サービスディスカバリー実行
                 self.logger.info("サービスディスカバリーを実行中...")
+                services = await self._get_services()
+                self.logger.info(f"{len(services.services)} 個のサービスを発見")
                 
-                # キャッシュをクリア
-                if hasattr(self.client, '_services'):
-                    self.client._services = None
-                
-                services = await self.client.get_services()
-                self.logger.info(f"{len(services)} 個のサービスを発見")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    for service in services:
+                        self.logger.debug(f"サービス: {service.uuid}")
+                        for char in service.characteristics:
+                            self.logger.debug(f"  特性: {char.uuid} - {char.properties}")
                 
                 # 必要な特性を確認
-                write_found = False
-                notify_found = False
-                
-                for service in services:
-                    self.logger.debug(f"サービス: {service.uuid}")
-                    for char in service.characteristics:
-                        self.logger.debug(f"  特性: {char.uuid} - {char.properties}")
-                        
-                        if char.uuid.lower() == self.config.write_characteristic_uuid.lower():
-                            write_found = True
-                        elif char.uuid.lower() == self.config.notify_characteristic_uuid.lower():
-                            notify_found = True
-                
-                if write_found and notify_found:
+                if self._resolve_characteristics(services):
                     self.logger.info("必要な特性を確認しました")
                     
+                    if self.gatt_cache:
+                        self.gatt_cache.put(
+                            self.device.address,
+                            self.fingerprint,
+                            self._notify_target.service_uuid,
+                            {char.uuid.lower(): char.handle
+                             for char in (self._write_target, self._notify_target)}
+                        )
+                    
                     # ディスカバリー後の待機
-                    await asyncio.sleep(self.config.post_discovery_wait)
+                    await self._settle(self.config.post_discovery_wait, self._is_connected)
                     return True
                 else:
                     self.logger.warning("必要な特性が見つかりません")
@@ -272,7 +998,7 @@ class BLESensorConnection:
             except BleakError as e:
                 if "GATT" in str(e):
                     self.logger.error(f"サービスディスカバリー中のGATTエラー: {e}")
-                    self.last_gatt_error_time = time.time()
+                    self._mark_gatt_error()
                     await asyncio.sleep(5.0)
                 else:
                     self.logger.error(f"サービスディスカバリーエラー: {e}")
@@ -288,22 +1014,22 @@ class BLESensorConnection:
         """通知設定とコマンド送信"""
         try:
             # 通知開始前の待機
-            await asyncio.sleep(1.0)
+            await self._settle(1.0, self._is_connected)
             
             # 通知を開始
             self.logger.info("通知を設定中...")
             await self.client.start_notify(
-                self.config.notify_characteristic_uuid,
+                self._notify_target,
                 self.handle_notification
             )
             
             # 通知開始後の待機
-            await asyncio.sleep(1.0)
+            await self._settle(1.0, self._is_connected)
             
             # 開始コマンドを送信
             self.logger.info("開始コマンドを送信...")
             await self.client.write_gatt_char(
-                self.config.write_characteristic_uuid,
+                self._write_target,
                 b'START\n'
             )
             
@@ -313,7 +1039,7 @@ class BLESensorConnection:
         except BleakError as e:
             if "GATT" in str(e):
                 self.logger.error(f"通知設定中のGATTエラー: {e}")
-                self.last_gatt_error_time = time.time()
+                self._mark_gatt_error()
             else:
                 self.logger.error(f"通知設定エラー: {e}")
             return False
@@ -322,49 +1048,115 @@ class BLESensorConnection:
             return False
     
     async def maintain_connection(self):
-        """接続を維持（キープアライブ）"""
-        if not self.config.keepalive_enabled:
+        """接続を維持（受信が途絶えたときだけキープアライブ、停止したら切断）
+        
+        通知が届いている間は書き込まない（GATT往復が通知と競合するため）。
+        受信が keepalive_idle_threshold 途絶えたらキープアライブを送り（keepalive_interval 以上あけて）、
+        keepalive_stall_intervals 回分途絶えたら OS の切断通知を待たずに切断して高速再接続させる。
+        リンク品質スコアが link_health_min_score を下回ったときも同様に再接続する。
+        """
+        threshold = self.config.keepalive_idle_threshold
+        stall_after = threshold * self.config.keepalive_stall_intervals
+        min_score = self.config.link_health_min_score
+        if not self.config.keepalive_enabled and stall_after <= 0 and min_score <= 0:
             return
         
+        started = time.time()
+        last_keepalive = 0.0
         while not self.should_stop and self.client and self.client.is_connected:
             try:
-                await asyncio.sleep(self.config.keepalive_interval)
+                now = time.time()
+                if min_score > 0 and self.health.samples >= self.config.link_health_warmup:
+                    score = self.health.score(now)
+                    if score < min_score:
+                        self.stats["health_reconnects"] += 1
+                        self.logger.warning(f"リンク品質が低下したため再接続します（スコア {score:.2f}）")
+                        await self._force_disconnect()
+                        break
                 
-                if self.client and self.client.is_connected:
-                    self.logger.debug("キープアライブ送信")
+                # 最後の受信から threshold 経つまで眠る
+                idle = now - max(self.stats["last_data_time"] or 0.0, started)
+                if idle < threshold:
+                    await asyncio.sleep(threshold - idle)
+                    continue
+                
+                if stall_after > 0 and idle >= stall_after:
+                    self.stats["stalls"] += 1
+                    self.logger.warning(f"{idle:.1f} 秒間データを受信していないため再接続します")
+                    await self._force_disconnect()
+                    break
+                
+                now = time.monotonic()
+                if (self.config.keepalive_enabled and self.client.is_connected
+                        and now - last_keepalive >= self.config.keepalive_interval):
+                    self.logger.debug(f"キープアライブ送信（{idle:.1f} 秒無通信）")
+                    last_keepalive = now
+                    self.stats["keepalives"] += 1
                     await self.client.write_gatt_char(
-                        self.config.write_characteristic_uuid,
+                        self._write_target,
                         self.config.keepalive_command
                     )
+                await asyncio.sleep(threshold)
                     
             except BleakError as e:
                 if "GATT" in str(e):
                     self.logger.error(f"キープアライブ中のGATTエラー: {e}")
-                    self.last_gatt_error_time = time.time()
+                    self._mark_gatt_error()
                 break
             except Exception as e:
                 self.logger.error(f"キープアライブエラー: {e}")
                 break
     
+    async def _force_disconnect(self):
+        """自分から切断する（切断通知が来なくても待機を解除する）"""
+        try:
+            if self.client and self.client.is_connected:
+                await asyncio.wait_for(self.client.disconnect(), timeout=self.config.connection_timeout)
+        except Exception as e:
+            self.logger.debug(f"切断エラー: {e}")
+        if not self.disconnected_event.is_set():
+            self.state = ConnectionState.DISCONNECTED
+            self.disconnected_event.set()
+            self.flush_batch()
+    
     def _on_disconnect(self, client):
         """切断コールバック"""
         self.logger.warning("接続が切断されました")
         self.state = ConnectionState.DISCONNECTED
         self.stats["disconnections"] += 1
+        self.disconnected_event.set()
+        self.flush_batch()
     
     async def connect_and_run(self) -> bool:
         """メイン接続処理"""
         try:
-            # デバイスを探す
-            device = await self.find_device()
-            if not device:
-                return False
+            connected = False
             
-            self.device = device
+            # 前回正常に動いていたデバイスにはスキャンせずに直接再接続
+            if self.config.fast_reconnect and self._last_session_ok and self.device:
+                self.logger.info(f"前回のデバイスに直接再接続: {self.device.address}")
+                connected = await self.connect_with_retry(
+                    self.device, timeout=self.config.direct_connect_timeout
+                )
+                if not connected:
+                    self.logger.info("直接再接続に失敗したためスキャンします")
+            self._last_session_ok = False
             
-            # 接続
-            if not await self.connect_with_retry(device):
-                return False
+            if not connected:
+                # デバイスを探す（マネージャーの共有スキャンで発見済みなら省略）
+                device = self._initial_device
+                self._initial_device = None
+                if not device:
+                    device = await self.find_device()
+                if not device:
+                    return False
+                
+                self.device = device
+                self.device_id = device.name or device.address
+                
+                # 接続
+                if not await self.connect_with_retry(device):
+                    return False
             
             # サービスディスカバリー
             if not await self.discover_services_with_retry():
@@ -380,6 +1172,8 @@ class BLESensorConnection:
             
             # 接続成功
             self.state = ConnectionState.CONNECTED
+            self._last_session_ok = True
+            self._use_fixed_waits = False
             self.logger.info("="*50)
             self.logger.info("データ受信を開始しました")
             self.logger.info("="*50)
@@ -388,10 +1182,7 @@ class BLESensorConnection:
             maintain_task = asyncio.create_task(self.maintain_connection())
             
             # 切断まで待機
-            try:
-                await self.client.disconnected_future
-            except:
-                pass
+            await self.disconnected_event.wait()
             
             maintain_task.cancel()
             return False
@@ -414,8 +1205,11 @@ class BLESensorConnection:
                 if reconnect_count > 0:
                     self.logger.info(f"再接続試行 {reconnect_count}")
                     
+                    # 正常だった接続が切れただけなら即座に再接続
+                    if self.config.fast_reconnect and self._last_session_ok:
+                        await asyncio.sleep(self.config.fast_reconnect_delay)
                     # GATTエラーの場合は長めに待機
-                    if self.stats["gatt_errors"] > 0:
+                    elif self._use_fixed_waits:
                         self.logger.info(f"GATTエラー回復のため {self.config.gatt_error_retry_delay} 秒待機...")
                         await asyncio.sleep(self.config.gatt_error_retry_delay)
                     else:
@@ -455,24 +1249,601 @@ class BLESensorConnection:
                 await self.client.disconnect()
             except:
                 pass
+        self.flush_batch()
+        if self._dispatcher:
+            self._dispatcher.close()
+
+# ================== 複数センサー管理 ==================
+class BLESensorManager:
+    """複数センサーの同時接続管理
+    
+    共有スキャンを1回行い、見つかったデバイスごとに BLESensorConnection を
+    同じイベントループ上で並行して動かす。各接続は個別に再起動される。
+    """
+    
+    def __init__(self, config: BLEConfig, data_callback: Optional[Callable] = None,
+                 transport: Optional[BleakTransport] = None):
+        self.config = config
+        self.logger = setup_logger(config)
+        self.data_callback = data_callback
+        self.transport = transport or BleakTransport()
+        
+        self.connections: Dict[str, BLESensorConnection] = {}  # アドレス -> 接続
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.should_stop = False
+        self.scan_lock: Optional[asyncio.Lock] = None
+        self.scan_duration = Histogram(DURATION_BUCKETS)  # 共有スキャンの所要時間
+    
+    @property
+    def stats(self) -> dict:
+        """デバイス名ごとの統計（リンク品質を含む）"""
+        now = time.time()
+        return {
+            conn.device.name: {**conn.stats, "health": conn.health.snapshot(now)}
+            for conn in self.connections.values()
+        }
+    
+    async def scan_devices(self) -> list:
+        """共有スキャンで未接続の対象デバイスをすべて探す（(device, advertisement_data) のリスト）"""
+        free_slots = self.config.max_connections - len(self.tasks)
+        
+        # 対象名がすべて完全一致で接続済みならスキャンしない。
+        # 部分一致（名前の先頭など）の対象名は何台あるかわからないので、接続済みのアドレスを除いて毎回探す
+        held_names = {conn.device.name for conn in self.connections.values()}
+        missing = [target for target in self.config.target_device_names if target not in held_names]
+        if free_slots <= 0 or not missing:
+            return []
+        
+        self.logger.info(f"共有スキャン中: {', '.join(missing)}")
+        try:
+            async with self.scan_lock:
+                started = time.monotonic()
+                found = await scan_for_devices(
+                    self.config, expected=free_slots, exclude=self.tasks,
+                    transport=self.transport, held_names=held_names
+                )
+                self.scan_duration.observe(time.monotonic() - started)
+        except Exception as e:
+            self.logger.error(f"スキャンエラー: {e}")
+            return []
+        
+        devices = found
+        if len(devices) > free_slots:
+            self.logger.warning(f"接続スロット不足: {len(devices) - free_slots} 台は接続しません")
+            devices = devices[:free_slots]
+        return devices
+    
+    def start_connection(self, device, advertisement_data: Optional[AdvertisementData] = None):
+        """デバイスごとの接続タスクを開始"""
+        # 再スキャン時は自分のデバイスだけを探す
+        config = replace(self.config, target_device_names=[device.name])
+        conn = BLESensorConnection(
+            config, data_callback=self.data_callback,
+            device=device, advertisement_data=advertisement_data,
+            transport=self.transport
+        )
+        conn.scan_lock = self.scan_lock
+        
+        self.connections[device.address] = conn
+        self.tasks[device.address] = asyncio.create_task(self._supervise(conn))
+        self.logger.info(f"接続タスク開始: {device.name} ({device.address})")
+    
+    async def _supervise(self, conn: BLESensorConnection):
+        """接続を個別に監視し、終了したら再起動"""
+        while not self.should_stop:
+            try:
+                await conn.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                conn.logger.error(f"接続タスクエラー: {e}")
+            
+            if self.should_stop:
+                break
+            
+            conn.logger.info(f"{self.config.reconnect_delay} 秒後に接続タスクを再起動します")
+            await asyncio.sleep(self.config.reconnect_delay)
+            conn.should_stop = False
+    
+    async def run(self):
+        """共有スキャンと接続タスクの管理ループ"""
+        self.logger.info("="*50)
+        self.logger.info("BLEセンサー接続マネージャー開始")
+        self.logger.info(f"対象: {', '.join(self.config.target_device_names)}")
+        self.logger.info(f"最大同時接続数: {self.config.max_connections}")
+        self.logger.info("="*50)
+        
+        self.scan_lock = asyncio.Lock()
+        
+        try:
+            while not self.should_stop:
+                for device, advertisement_data in await self.scan_devices():
+                    self.start_connection(device, advertisement_data)
+                
+                await asyncio.sleep(self.config.rescan_interval)
+        finally:
+            await self.stop()
+            
+            # 統計表示
+            for name, stats in self.stats.items():
+                self.logger.info(
+                    f"{name}: 接続 {stats['connections']} / 切断 {stats['disconnections']} / "
+                    f"受信 {stats['data_received']} / GATTエラー {stats['gatt_errors']}"
+                )
+    
+    async def stop(self):
+        """全接続を停止"""
+        self.should_stop = True
+        for conn in self.connections.values():
+            await conn.stop()
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+
+# ================== WebSocket配信 ==================
+# バイナリ形式（サブプロトコル "kiriri.bin.v1" または {"cmd": "format", "format": "binary"} で選択）
+#
+# 1フレーム = 1デバイス分のサンプル列（リトルエンディアン）:
+#     ヘッダー: magic "KB", version u8, device_id の長さ u8, 件数 u16, 基準時刻 f64, device_id (UTF-8)
+#     時刻列: u16 × 件数（基準時刻からのミリ秒）
+#     y列: i16 × 件数（1/100 度）
+#     x列: i16 × 件数（1/100 度）
+BINARY_SUBPROTOCOL = "kiriri.bin.v1"
+FRAME_HEADER = struct.Struct("<2sBBHd")
+FRAME_MAGIC = b"KB"
+FRAME_VERSION = 1
+MAX_FRAME_SPAN = 65.0  # u16 ミリ秒に収まる範囲（秒）
+
+class BinaryFrameBuilder:
+    """1デバイス分のサンプルを溜めてバイナリフレームにまとめる"""
+    
+    def __init__(self, device_id: str, max_samples: int):
+        self.device_id = device_id.encode("utf-8")[:255]
+        self.max_samples = min(max_samples, 0xFFFF)
+        self.base_time = 0.0
+        self.offsets = array("H")
+        self.y = array("h")
+        self.x = array("h")
+    
+    def append(self, sample: Sample) -> Optional[bytes]:
+        """1サンプル追加（フレームが埋まった・時刻が収まらないときは完成したフレームを返す）"""
+        frame = None
+        if self.offsets and (
+            len(self.offsets) >= self.max_samples
+            or not 0.0 <= sample.timestamp - self.base_time < MAX_FRAME_SPAN
+        ):
+            frame = self.take()
+        if not self.offsets:
+            self.base_time = sample.timestamp
+        
+        self.offsets.append(int((sample.timestamp - self.base_time) * 1000))
+        self.y.append(max(-32768, min(32767, sample.y)))
+        self.x.append(max(-32768, min(32767, sample.x)))
+        return frame
+    
+    def take(self) -> Optional[bytes]:
+        """溜まったサンプルをフレームにして空にする"""
+        count = len(self.offsets)
+        if count == 0:
+            return None
+        frame = b"".join((
+            FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, len(self.device_id), count, self.base_time),
+            self.device_id,
+            self.offsets.tobytes(),
+            self.y.tobytes(),
+            self.x.tobytes(),
+        ))
+        del self.offsets[:]
+        del self.y[:]
+        del self.x[:]
+        return frame
+
+def decode_frame(frame: bytes):
+    """バイナリフレームを Sample のリストに戻す（確認・ツール用）"""
+    magic, version, id_length, count, base_time = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("バイナリフレームではありません")
+    position = FRAME_HEADER.size
+    device_id = frame[position:position + id_length].decode("utf-8")
+    position += id_length
+    offsets = array("H", frame[position:position + 2 * count])
+    y = array("h", frame[position + 2 * count:position + 4 * count])
+    x = array("h", frame[position + 4 * count:position + 6 * count])
+    return [Sample(device_id, y[i], x[i], base_time + offsets[i] / 1000.0) for i in range(count)]
+
+def _select_subprotocol(connection, subprotocols):
+    """バイナリ形式を要求されたら受け入れ、サブプロトコルなしの接続も拒否しない"""
+    return BINARY_SUBPROTOCOL if BINARY_SUBPROTOCOL in subprotocols else None
+
+class WebSocketClient:
+    """WebSocketクライアントごとの送信キュー
+    
+    キューは上限付きで、溢れたら古いサンプルから破棄する。
+    遅いクライアントがBLE通知処理や他のクライアントを止めないようにするため。
+    """
+    
+    def __init__(self, websocket, queue_size: int, binary: bool = False):
+        self.websocket = websocket
+        self.binary = binary  # True ならサンプルはバイナリフレームで受け取る
+        self.queue = deque(maxlen=queue_size)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+    
+    def push(self, message):
+        """送信キューに追加（ブロックしない）"""
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        self.ready.set()
+    
+    async def send_loop(self):
+        """キューの中身を順に送信"""
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                await self.websocket.send(self.queue.popleft())
+
+class WebSocketServer:
+    """受信データをすべてのブラウザに配信するWebSocketサーバー
+    
+    送信形式は pairing_test.js に合わせた JSON {id, y, x}（y/x は度）が既定。
+    バイナリ形式を選んだクライアントには、デバイスごとにまとめたフレームを
+    websocket_frame_interval ごとに送る（イベント・返信は JSON のまま）。
+    """
+    
+    def __init__(self, config: BLEConfig):
+        self.config = config
+        self.logger = setup_logger(config, "WebSocket")
+        self.clients = set()
+        self.commands: Dict[str, Callable[[dict], Union[Optional[dict], Awaitable[Optional[dict]]]]] = {}
+        self._command_tasks = set()  # 非同期コマンドの処理中タスク
+        self.frames: Dict[str, BinaryFrameBuilder] = {}
+        self._server = None
+        self._frame_task: Optional[asyncio.Task] = None
+        self._dropped_closed = 0  # 切断済みクライアントの破棄数
+    
+    @property
+    def stats(self) -> dict:
+        """配信統計"""
+        return {
+            "clients": len(self.clients),
+            "dropped": self._dropped_closed + sum(client.dropped for client in self.clients),
+        }
+    
+    async def start(self):
+        """サーバー開始"""
+        if websockets is None:
+            self.logger.warning("websockets がインストールされていないため WebSocket 配信を無効にします")
+            return
+        
+        self._server = await websockets.serve(
+            self._handler,
+            self.config.websocket_host,
+            self.config.websocket_port,
+            subprotocols=[BINARY_SUBPROTOCOL],
+            select_subprotocol=_select_subprotocol
+        )
+        self._frame_task = asyncio.create_task(self._frame_loop())
+        self.logger.info(
+            f"WebSocketサーバー開始: ws://{self.config.websocket_host}:{self.config.websocket_port}"
+        )
+    
+    async def stop(self):
+        """サーバー停止"""
+        if self._frame_task:
+            self._frame_task.cancel()
+            self._frame_task = None
+        for task in self._command_tasks:
+            task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    def publish(self, sample: Sample):
+        """1サンプルを全クライアントに配信（エンコードは形式ごとに1回だけ）"""
+        if not self.clients:
+            return
+        message = None
+        binary = False
+        for client in self.clients:
+            if client.binary:
+                binary = True
+                continue
+            if message is None:
+                message = json.dumps({"id": sample.device_id, "y": sample.y / 100.0, "x": sample.x / 100.0})
+            client.push(message)
+        
+        if binary:
+            builder = self.frames.get(sample.device_id)
+            if builder is None:
+                builder = BinaryFrameBuilder(sample.device_id, self.config.websocket_frame_max_samples)
+                self.frames[sample.device_id] = builder
+            frame = builder.append(sample)
+            if frame is not None:
+                self._push_frame(frame)
+    
+    def flush_frames(self):
+        """溜まったバイナリフレームを送信キューに入れる"""
+        for builder in self.frames.values():
+            frame = builder.take()
+            if frame is not None:
+                self._push_frame(frame)
+    
+    def _push_frame(self, frame: bytes):
+        for client in self.clients:
+            if client.binary:
+                client.push(frame)
+    
+    async def _frame_loop(self):
+        """websocket_frame_interval ごとにバイナリフレームを送る"""
+        while True:
+            await asyncio.sleep(self.config.websocket_frame_interval)
+            self.flush_frames()
+    
+    def register_command(self, name: str, handler: Callable[[dict], Union[Optional[dict], Awaitable[Optional[dict]]]]):
+        """クライアントからのコマンド {"cmd": name, ...} の処理を登録（戻り値は返信）
+        
+        重い処理（ファイル読み込みなど）はコルーチン関数にして、中で run_in_executor に回す。
+        """
+        self.commands[name] = handler
+    
+    def publish_event(self, event):
+        """状態変化などのイベントを全クライアントに配信（to_dict() を持つもの）"""
+        if not self.clients:
+            return
+        message = json.dumps(event.to_dict(), ensure_ascii=False)
+        for client in self.clients:
+            client.push(message)
+    
+    def _command_format(self, client: WebSocketClient, message: dict) -> dict:
+        """{"cmd": "format", "format": "json"|"binary"}"""
+        fmt = message.get("format")
+        if fmt not in ("json", "binary"):
+            return {"ok": False, "error": "format は json か binary です"}
+        client.binary = fmt == "binary"
+        return {"ok": True, "format": fmt}
+    
+    def _handle_message(self, client: WebSocketClient, raw):
+        """クライアントからのコマンドを処理"""
+        try:
+            message = json.loads(raw)
+            if message.get("cmd") == "format":
+                # 送信形式はクライアントごとの設定
+                handler = partial(self._command_format, client)
+            else:
+                handler = self.commands.get(message.get("cmd"))
+        except (ValueError, AttributeError):
+            return
+        if handler is None:
+            return
+        
+        try:
+            reply = handler(message)
+        except Exception as e:
+            self.logger.error(f"コマンド処理エラー: {e}")
+            reply = {"ok": False, "error": str(e)}
+        if inspect.isawaitable(reply):
+            # 非同期コマンドは終わってから返信（その間も受信・配信は止めない）
+            task = asyncio.create_task(self._reply_later(client, message["cmd"], reply))
+            self._command_tasks.add(task)
+            task.add_done_callback(self._command_tasks.discard)
+            return
+        self._reply(client, message["cmd"], reply)
+    
+    async def _reply_later(self, client: WebSocketClient, cmd: str, pending: Awaitable[Optional[dict]]):
+        try:
+            reply = await pending
+        except Exception as e:
+            self.logger.error(f"コマンド処理エラー: {e}")
+            reply = {"ok": False, "error": str(e)}
+        self._reply(client, cmd, reply)
+    
+    def _reply(self, client: WebSocketClient, cmd: str, reply: Optional[dict]):
+        if reply is not None:
+            client.push(json.dumps({"type": "reply", "cmd": cmd, **reply}, ensure_ascii=False))
+    
+    async def _handler(self, websocket, path=None):
+        """クライアント接続ごとの処理"""
+        client = WebSocketClient(
+            websocket,
+            self.config.websocket_client_queue_size,
+            binary=getattr(websocket, "subprotocol", None) == BINARY_SUBPROTOCOL
+        )
+        self.clients.add(client)
+        self.logger.info(f"クライアント接続: {websocket.remote_address} (計 {len(self.clients)})")
+        
+        sender = asyncio.create_task(client.send_loop())
+        try:
+            # クライアントからのコマンド受信（切断検知も兼ねる）
+            async for raw in websocket:
+                self._handle_message(client, raw)
+        except Exception as e:
+            self.logger.debug(f"クライアント受信エラー: {e}")
+        finally:
+            sender.cancel()
+            self.clients.discard(client)
+            self._dropped_closed += client.dropped
+            self.logger.info(f"クライアント切断: {websocket.remote_address} (計 {len(self.clients)})")
 
 # ================== メイン関数 ==================
-def data_handler(data: str, sender):
-    """データ処理コールバック例"""
-    # ここでデータを処理
-    pass
+def data_handler(sinks: list, sample, sender):
+    """データ処理コールバック：各出力先（配信・記録）へ渡す（SampleBatch も可）"""
+    samples = sample if isinstance(sample, SampleBatch) else (sample,)
+    for item in samples:
+        for sink in sinks:
+            sink(item)
 
-async def main():
-    """メイン処理"""
-    # 設定
-    config = BLEConfig(
+def collect_metrics(manager: BLESensorManager, server: WebSocketServer, writer: MetricsWriter,
+                    lag_monitor: Optional[LoopLagMonitor] = None):
+    """スクレイプ時に各統計を読み出してメトリクスにする"""
+    connections = [({"device": conn.device_id or conn.device.address}, conn)
+                   for conn in manager.connections.values()]
+    
+    def per_device(key):
+        return [(labels, conn.stats.get(key, 0)) for labels, conn in connections]
+    
+    writer.counter("samples_total", "受信した通知数", per_device("data_received"))
+    writer.counter("parse_errors_total", "解析できなかった通知数", per_device("parse_errors"))
+    writer.counter("connections_total", "接続回数", per_device("connections"))
+    writer.counter("disconnections_total", "切断回数", per_device("disconnections"))
+    writer.counter("gatt_errors_total", "GATTエラー数", per_device("gatt_errors"))
+    writer.counter("stalls_total", "無通信による再接続数", per_device("stalls"))
+    writer.counter("callback_dropped_total", "コールバック待ちで破棄したサンプル数", per_device("callback_dropped"))
+    writer.counter("websocket_dropped_total", "WebSocket送信キューで破棄したメッセージ数",
+                   [(None, server.stats["dropped"])])
+    
+    writer.gauge("connection_state", "接続状態（該当する state が 1）", [
+        ({**labels, "state": state.name.lower()}, int(conn.state is state))
+        for labels, conn in connections for state in ConnectionState
+    ])
+    writer.gauge("callback_queue_depth", "コールバック待ちのサンプル数", [
+        (labels, conn.stats.get("callback_queue_depth", conn.stats.get("callback_pending_tasks", 0)))
+        for labels, conn in connections
+    ])
+    writer.gauge("link_health_score", "リンク品質スコア（0〜1）", [
+        (labels, round(conn.health.score(time.time()), 4)) for labels, conn in connections
+    ])
+    writer.gauge("websocket_clients", "WebSocket購読者数", [(None, server.stats["clients"])])
+    
+    writer.histogram("delivery_latency_seconds", "受信からコールバックへの配送までの時間",
+                     [(labels, conn.delivery_latency) for labels, conn in connections])
+    writer.histogram("connect_duration_seconds", "接続にかかった時間",
+                     [(labels, conn.connect_duration) for labels, conn in connections])
+    writer.histogram("scan_duration_seconds", "スキャンにかかった時間",
+                     [({"device": "shared"}, manager.scan_duration)]
+                     + [(labels, conn.scan_duration) for labels, conn in connections])
+    
+    if lag_monitor is not None:
+        writer.histogram("event_loop_lag_seconds", "イベントループの起床の遅れ",
+                         [(None, lag_monitor.histogram)])
+        writer.counter("event_loop_over_budget_total", "遅れが予算を超えた回数",
+                       [(None, lag_monitor.over_budget)])
+
+async def setup_outputs(config: BLEConfig):
+    """出力先（配信・姿勢判定・履歴・記録）を組み立てる
+    
+    戻り値は (server, sinks, background_tasks, closables)。closables は終了時に close() する。
+    sinks はどれもイベントループ上から呼ぶ前提（スレッドセーフではない）。
+    """
+    if config.callback_workers > 0:
+        raise ValueError(
+            "callback_workers は 0 にしてください（配信・姿勢判定・履歴・記録はイベントループ上でしか呼べません）"
+        )
+    
+    sinks = []
+    background_tasks = []
+    closables = []
+    
+    # WebSocket配信サーバー
+    server = WebSocketServer(config)
+    if config.websocket_enabled:
+        await server.start()
+        sinks.append(server.publish)
+    
+    # 姿勢判定（状態変化だけを配信）
+    if config.posture_enabled:
+        posture = PostureEngine(config.posture_file)
+        posture.listeners.append(server.publish_event)
+        server.register_command("calibrate", posture.command_calibrate)
+        server.register_command("profile", posture.command_profile)
+        sinks.append(posture.write)
+    
+    # 直近履歴
+    history = None
+    if config.history_capacity > 0:
+        if SampleHistory is None:
+            logging.getLogger("BLESensor").warning("numpy がインストールされていないため履歴を無効にします")
+        else:
+            history = SampleHistory(config.history_capacity)
+            sinks.append(history.write)
+    
+    # 間引き済みの履歴（直近履歴・記録ファイル）
+    if command_history is not None:
+        server.register_command("history", partial(command_history, history, config.record_dir))
+    
+    # 多段ロールアップ（長時間の表示用）
+    if config.rollup_resolutions and RollupStore is not None:
+        rollups = RollupStore(config.rollup_resolutions, config.rollup_capacity)
+        server.register_command("rollup", rollups.command_rollup)
+        sinks.append(rollups.write)
+    
+    # セッション記録
+    if config.record_dir:
+        recorder = SampleRecorder(
+            config.record_dir,
+            batch_size=config.record_batch_size,
+            flush_interval=config.record_flush_interval,
+            rotate_bytes=config.record_rotate_bytes,
+            rotate_seconds=config.record_rotate_seconds
+        )
+        sinks.append(recorder.write)
+        background_tasks.append(asyncio.create_task(recorder.run()))
+        closables.append(recorder)
+    
+    # 共有メモリのサンプルバス
+    if config.shm_bus_enabled:
+        if SampleBus is None:
+            logging.getLogger("BLESensor").warning("numpy がインストールされていないため共有メモリのバスを無効にします")
+        else:
+            bus = SampleBus(config.shm_bus_prefix, config.shm_bus_capacity)
+            sinks.append(bus.write)
+            closables.append(bus)
+    
+    return server, sinks, background_tasks, closables
+
+def run_event_loop(main_coroutine, config: BLEConfig):
+    """設定したイベントループでコルーチンを実行する"""
+    # Windows対応
+    if platform.system() == "Windows":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    elif config.event_loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            logging.getLogger("BLESensor").warning("uvloop がインストールされていないため asyncio のループを使います")
+        else:
+            if hasattr(uvloop, "run"):
+                return uvloop.run(main_coroutine)
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(main_coroutine)
+
+def default_config() -> BLEConfig:
+    """ブリッジの既定設定"""
+    return BLEConfig(
         target_device_names=["KIRIRI01", "KIRIRI02", "KIRIRI03"],
         max_reconnect_attempts=-1,  # 無限再接続
         log_level="INFO"
     )
+
+async def main(config: Optional[BLEConfig] = None):
+    """メイン処理"""
+    # 設定
+    config = config or default_config()
+    
+    server, sinks, background_tasks, closables = await setup_outputs(config)
+    
+    # イベントループの遅れの監視
+    lag_monitor = None
+    if config.loop_lag_interval > 0:
+        lag_monitor = LoopLagMonitor(
+            config.loop_lag_interval, config.loop_lag_budget_ms / 1000.0, logger=setup_logger(config, "Loop")
+        )
+        background_tasks.append(asyncio.create_task(lag_monitor.run()))
+    
+    # サービス作成（1プロセスで全センサーを扱う）
+    service = BLESensorManager(config, data_callback=partial(data_handler, sinks))
     
-    # サービス作成
-    service = BLESensorConnection(config, data_callback=data_handler)
+    # メトリクス（値はスクレイプ時に読み出す）
+    metrics = None
+    if config.metrics_enabled:
+        metrics = MetricsServer(
+            config.metrics_host, config.metrics_port,
+            partial(collect_metrics, service, server, lag_monitor=lag_monitor), setup_logger(config, "Metrics")
+        )
+        await metrics.start()
     
     try:
         await service.run()
@@ -480,10 +1851,14 @@ async def main():
         print("\n中断されました")
     finally:
         await service.stop()
+        await server.stop()
+        if metrics:
+            await metrics.stop()
+        for task in background_tasks:
+            task.cancel()
+        for closable in closables:
+            closable.close()
 
 if __name__ == "__main__":
-    # Windows対応
-    if platform.system() == "Windows":
-        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-    
-    asyncio.run(main())
+    config = default_config()
+    run_event_loop(main(config), config)
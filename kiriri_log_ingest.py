@@ -0,0 +1,127 @@
+"""
+ログの一括取り込み - ble_sensor_service.log の「受信データ」行を NumPy 配列にする
+
+ログを mmap し、改行位置で区切ったチャンクごとにプロセスプールで並列に解析する。
+各チャンクはバイト列のまま正規表現で (時刻, y, x) を抜き出し、時刻は datetime64 に
+まとめて変換する（行ごとの strptime をしない）。結果は npz か記録ファイル（.krec）に保存できる。
+
+    python kiriri_log_ingest.py ble_sensor_service.log --npz samples.npz
+    python kiriri_log_ingest.py ble_sensor_service.log --record records --device KIRIRI01
+"""
+
+import argparse
+import mmap
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from kiriri_recorder import SessionRecorder
+
+# 「受信データ [時刻]: N:<y>:<x>」（時刻は setup_logger と同じローカル時刻のミリ秒まで）
+_LINE_PATTERN = re.compile(
+    r"受信データ \[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3})\]: N:(-?\d+):(-?\d+)".encode("utf-8")
+)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+def chunk_ranges(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """ファイルを改行位置でそろえた (開始, 終了) の範囲に分ける"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                newline = buffer.find(b"\n", end)
+                end = size if newline < 0 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _local_to_epoch(naive_seconds: np.ndarray) -> np.ndarray:
+    """ローカル時刻（UTC とみなした秒）を UNIX 時刻にする（UTC オフセットは1時間単位で求める）"""
+    hours, inverse = np.unique(naive_seconds // 3600, return_inverse=True)
+    epoch = datetime(1970, 1, 1)
+    offsets = np.array([
+        (epoch + timedelta(hours=int(hour))).timestamp() - int(hour) * 3600 for hour in hours
+    ])
+    return naive_seconds + offsets[inverse]
+
+def parse_chunk(path: str, start: int, end: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """1チャンク分を解析して (timestamps f64, y i16, x i16) を返す（プロセスプールから呼ばれる）"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        matches = _LINE_PATTERN.findall(buffer, start, end)
+    if not matches:
+        return np.empty(0), np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16)
+
+    stamps, ys, xs = zip(*matches)
+    naive = np.array(stamps).astype("datetime64[ms]").astype(np.int64) / 1000.0
+    return (
+        _local_to_epoch(naive),
+        np.array(ys).astype(np.int32).clip(-32768, 32767).astype(np.int16),
+        np.array(xs).astype(np.int32).clip(-32768, 32767).astype(np.int16),
+    )
+
+def ingest_log(path: str, workers: Optional[int] = None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ログ全体を (timestamps, y, x) の配列にする（workers=1 でプロセスプールを使わない）"""
+    ranges = chunk_ranges(path, chunk_size)
+    if workers == 1 or len(ranges) <= 1:
+        parts = [parse_chunk(path, start, end) for start, end in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(
+                parse_chunk, [path] * len(ranges), [r[0] for r in ranges], [r[1] for r in ranges]
+            ))
+
+    if not parts:
+        return np.empty(0), np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16)
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+def write_recording(directory: str, device_id: str, timestamps, y, x, block_size: int = 4096) -> List[str]:
+    """配列を記録ファイル形式で書き出す（作成したファイルのパスを返す）"""
+    recorder = SessionRecorder(directory, device_id, batch_size=block_size)
+    paths = []
+    for start in range(0, len(timestamps), block_size):
+        recorder.extend(
+            timestamps[start:start + block_size], y[start:start + block_size], x[start:start + block_size]
+        )
+        if recorder.path and recorder.path not in paths:
+            paths.append(recorder.path)
+    recorder.close()
+    return paths
+
+# ================== メイン ==================
+def main():
+    parser = argparse.ArgumentParser(description="ble_sensor_service.log の受信データを取り込む")
+    parser.add_argument("log", help="ログファイル")
+    parser.add_argument("--npz", help="NumPy の npz に保存（timestamps, y, x）")
+    parser.add_argument("--record", help="記録ファイル（.krec）を書き出すディレクトリ")
+    parser.add_argument("--device", default="KIRIRI-LOG", help="記録ファイルのデバイス名")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定は CPU 数）")
+    parser.add_argument("--chunk-mb", type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024), help="チャンクサイズ (MB)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    timestamps, y, x = ingest_log(args.log, args.workers, args.chunk_mb * 1024 * 1024)
+    elapsed = time.perf_counter() - started
+    size_mb = os.path.getsize(args.log) / (1024 * 1024)
+    print(f"{len(timestamps)} サンプル / {size_mb:.1f} MB / {elapsed:.2f} 秒 ({size_mb / max(elapsed, 1e-9):.0f} MB/秒)")
+
+    if args.npz:
+        np.savez(args.npz, timestamps=timestamps, y=y, x=x)
+        print(f"保存: {args.npz}")
+    if args.record:
+        for path in write_recording(args.record, args.device, timestamps, y, x):
+            print(f"保存: {path}")
+
+if __name__ == "__main__":
+    main()
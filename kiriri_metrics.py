@@ -0,0 +1,174 @@
+"""
+メトリクス - Prometheus テキスト形式の HTTP エンドポイント
+
+値はイベントループ上でのみ更新する（ロック不要）。カウンター・ゲージは
+スクレイプ時に各コンポーネントの stats から読み出し、分布だけを Histogram に溜める。
+
+    curl http://localhost:9108/metrics
+"""
+
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# 秒単位の既定バケット
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+Labels = Dict[str, str]
+
+class Histogram:
+    """累積しない固定バケットのヒストグラム（observe は二分探索と加算だけ）"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Iterable[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class LoopLagMonitor:
+    """イベントループの遅れ（予定時刻からの起床の遅れ）を計測する
+
+    interval ごとに眠り、実際に起きた時刻との差をヒストグラムに入れる。
+    差が budget を超えたら、その間ループを占有したコールバックがあったとして警告する
+    （警告は warn_interval に1回まで）。
+    """
+
+    def __init__(self, interval: float = 0.1, budget: float = 0.05, warn_interval: float = 10.0,
+                 logger: Optional[logging.Logger] = None):
+        self.interval = interval
+        self.budget = budget
+        self.warn_interval = warn_interval
+        self.logger = logger or logging.getLogger("BLESensor")
+        self.histogram = Histogram(LOOP_LAG_BUCKETS)
+        self.max_lag = 0.0
+        self.over_budget = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_warning = 0.0
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(now - expected, 0.0)
+            self.histogram.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > self.budget:
+                self.over_budget += 1
+                if now >= next_warning:
+                    next_warning = now + self.warn_interval
+                    self.logger.warning(
+                        f"イベントループが {lag * 1000:.1f} ms 遅れました"
+                        f"（予算 {self.budget * 1000:.0f} ms 超過 {self.over_budget} 回）"
+                    )
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Optional[Labels]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+class MetricsWriter:
+    """Prometheus テキスト形式（version 0.0.4）の組み立て"""
+
+    def __init__(self, prefix: str = "kiriri_"):
+        self.prefix = prefix
+        self.lines = []
+
+    def _header(self, name: str, kind: str, help_text: str) -> str:
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        return name
+
+    def counter(self, name: str, help_text: str, values: Iterable[Tuple[Optional[Labels], float]]):
+        name = self._header(name, "counter", help_text)
+        for labels, value in values:
+            self.lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    def gauge(self, name: str, help_text: str, values: Iterable[Tuple[Optional[Labels], float]]):
+        name = self._header(name, "gauge", help_text)
+        for labels, value in values:
+            self.lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, values: Iterable[Tuple[Optional[Labels], Histogram]]):
+        name = self._header(name, "histogram", help_text)
+        for labels, histogram in values:
+            labels = labels or {}
+            total = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                total += count
+                self.lines.append(f"{name}_bucket{_format_labels({**labels, 'le': f'{bound:g}'})} {total}")
+            self.lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+            self.lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            self.lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+class MetricsServer:
+    """GET /metrics に応答する最小限の HTTP サーバー（イベントループ上で動く）"""
+
+    def __init__(self, host: str, port: int, collect: Callable[[MetricsWriter], None],
+                 logger: Optional[logging.Logger] = None):
+        self.host = host
+        self.port = port
+        self.collect = collect
+        self.logger = logger or logging.getLogger("BLESensor")
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.logger.info(f"メトリクス公開: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def render(self) -> str:
+        writer = MetricsWriter()
+        self.collect(writer)
+        return writer.text()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            # ヘッダーは読み捨てる
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.render().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+                content_type = "text/plain; charset=utf-8"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            self.logger.debug(f"メトリクス応答エラー: {e}")
+        finally:
+            writer.close()
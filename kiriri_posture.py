@@ -0,0 +1,225 @@
+"""
+姿勢判定 - デバイス・ユーザーごとの基準姿勢と閾値で良い/悪いを判定する
+
+ブラウザの checkPosture() はサンプルごとに判定して画面を書き換えていたが、
+ここではヒステリシスと最小継続時間で判定を安定させ、状態が変わったときだけ
+PostureEvent を通知する。
+"""
+
+import json
+import os
+from dataclasses import asdict, dataclass, fields
+from enum import Enum
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+@dataclass
+class PostureProfile:
+    """ユーザーごとの判定設定（角度は度）"""
+    user: str = "default"
+    threshold_y: float = 5.0   # 前後の許容範囲
+    threshold_x: float = 3.0   # 左右の許容範囲
+    hysteresis: float = 0.2    # 良い姿勢に戻る閾値 = threshold × (1 - hysteresis)
+    min_duration: float = 2.0  # この時間続いたら状態が変わったとみなす（秒）
+
+class PostureState(Enum):
+    """姿勢の状態"""
+    UNKNOWN = "unknown"
+    GOOD = "good"
+    BAD = "bad"
+
+class PostureEvent(NamedTuple):
+    """姿勢の状態変化"""
+    device_id: str
+    user: str
+    state: PostureState
+    previous: PostureState
+    timestamp: float
+    dy: float  # 基準からのずれ（度）
+    dx: float
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "posture",
+            "id": self.device_id,
+            "user": self.user,
+            "state": self.state.value,
+            "previous": self.previous.value,
+            "timestamp": self.timestamp,
+            "dy": round(self.dy, 2),
+            "dx": round(self.dx, 2),
+        }
+
+class PostureEvaluator:
+    """1デバイスの逐次判定（1/100 度の整数のまま比較する）"""
+
+    def __init__(self, device_id: str, reference: Tuple[int, int], profile: PostureProfile):
+        self.device_id = device_id
+        self.reference = reference
+        self.state = PostureState.UNKNOWN
+        self._candidate: Optional[PostureState] = None
+        self._candidate_since = 0.0
+        self.set_profile(profile)
+
+    def set_profile(self, profile: PostureProfile):
+        self.profile = profile
+        self._bad_y = profile.threshold_y * 100
+        self._bad_x = profile.threshold_x * 100
+        self._good_y = self._bad_y * (1.0 - profile.hysteresis)
+        self._good_x = self._bad_x * (1.0 - profile.hysteresis)
+
+    def update(self, y: int, x: int, timestamp: float) -> Optional[PostureEvent]:
+        """1サンプル判定し、状態が変わったときだけイベントを返す"""
+        dy = abs(y - self.reference[0])
+        dx = abs(x - self.reference[1])
+
+        if self.state is PostureState.BAD:
+            observed = PostureState.GOOD if dy < self._good_y and dx < self._good_x else PostureState.BAD
+        else:
+            observed = PostureState.BAD if dy >= self._bad_y or dx >= self._bad_x else PostureState.GOOD
+
+        if observed is self.state:
+            self._candidate = None
+            return None
+
+        # 最初の判定はすぐに通知、それ以降は min_duration 続いたら切り替える
+        if self.state is not PostureState.UNKNOWN:
+            if observed is not self._candidate:
+                self._candidate = observed
+                self._candidate_since = timestamp
+            if timestamp - self._candidate_since < self.profile.min_duration:
+                return None
+
+        previous = self.state
+        self.state = observed
+        self._candidate = None
+        return PostureEvent(
+            self.device_id, self.profile.user, observed, previous, timestamp,
+            (y - self.reference[0]) / 100.0, (x - self.reference[1]) / 100.0
+        )
+
+class PostureEngine:
+    """デバイスごとの基準姿勢とユーザーごとの閾値を管理する判定エンジン
+
+    保存形式（JSON）:
+        {"profiles": {user: PostureProfile}, "devices": {device_id: {"user": str, "reference": [y, x]}}}
+    reference は 1/100 度の整数。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.profiles: Dict[str, PostureProfile] = {"default": PostureProfile()}
+        self.devices: Dict[str, dict] = {}
+        self.evaluators: Dict[str, PostureEvaluator] = {}
+        self.listeners: List[Callable[[PostureEvent], None]] = []
+        self._latest: Dict[str, Tuple[int, int]] = {}
+        self.load()
+
+    # ---------- 永続化 ----------
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        names = {field.name for field in fields(PostureProfile)}
+        for user, values in data.get("profiles", {}).items():
+            values = {key: value for key, value in values.items() if key in names}
+            self.profiles[user] = PostureProfile(**{**values, "user": user})
+        for device_id, entry in data.get("devices", {}).items():
+            self.devices[device_id] = entry
+            if entry.get("reference"):
+                self._rebuild(device_id)
+
+    def save(self):
+        if not self.path:
+            return
+        data = {
+            "profiles": {user: asdict(profile) for user, profile in self.profiles.items()},
+            "devices": self.devices,
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    # ---------- 設定 ----------
+    def profile_for(self, device_id: str) -> PostureProfile:
+        user = self.devices.get(device_id, {}).get("user", "default")
+        return self.profiles.get(user) or self.profiles["default"]
+
+    def set_profile(self, profile: PostureProfile):
+        """ユーザーの閾値を登録・更新"""
+        self.profiles[profile.user] = profile
+        for device_id, evaluator in self.evaluators.items():
+            if self.devices[device_id].get("user", "default") == profile.user:
+                evaluator.set_profile(profile)
+        self.save()
+
+    def assign_user(self, device_id: str, user: str):
+        """デバイスを使うユーザーを設定"""
+        self.devices.setdefault(device_id, {})["user"] = user
+        if device_id in self.evaluators:
+            self.evaluators[device_id].set_profile(self.profile_for(device_id))
+        self.save()
+
+    def calibrate(self, device_id: str, y: Optional[int] = None, x: Optional[int] = None) -> bool:
+        """基準姿勢を設定（省略時は直近のサンプル）。判定は最初からやり直す"""
+        if y is None or x is None:
+            if device_id not in self._latest:
+                return False
+            y, x = self._latest[device_id]
+        self.devices.setdefault(device_id, {})["reference"] = [int(y), int(x)]
+        self._rebuild(device_id)
+        self.save()
+        return True
+
+    def _rebuild(self, device_id: str):
+        reference = tuple(self.devices[device_id]["reference"])
+        self.evaluators[device_id] = PostureEvaluator(device_id, reference, self.profile_for(device_id))
+
+    # ---------- 判定 ----------
+    def write(self, sample):
+        """1サンプル判定（Sample 互換: device_id, y, x, timestamp）"""
+        self._latest[sample.device_id] = (sample.y, sample.x)
+        evaluator = self.evaluators.get(sample.device_id)
+        if evaluator is None:
+            return
+        event = evaluator.update(sample.y, sample.x, sample.timestamp)
+        if event is not None:
+            for listener in self.listeners:
+                listener(event)
+
+    # ---------- WebSocketコマンド ----------
+    def command_calibrate(self, message: dict) -> dict:
+        """{"cmd": "calibrate", "id": device_id, ["y": 度, "x": 度], ["user": user]}"""
+        device_id = message.get("id")
+        if not device_id:
+            return {"ok": False, "error": "id がありません"}
+        if message.get("user"):
+            self.assign_user(device_id, str(message["user"]))
+
+        y = message.get("y")
+        x = message.get("x")
+        if isinstance(y, (int, float)) and isinstance(x, (int, float)):
+            ok = self.calibrate(device_id, round(y * 100), round(x * 100))
+        else:
+            ok = self.calibrate(device_id)
+        return {"ok": ok, "id": device_id}
+
+    def command_profile(self, message: dict) -> dict:
+        """{"cmd": "profile", "user": user, ["threshold_y", "threshold_x", "hysteresis", "min_duration"]}"""
+        user = str(message.get("user") or "default")
+        current = asdict(self.profiles.get(user, PostureProfile(user=user)))
+        for key in ("threshold_y", "threshold_x", "hysteresis", "min_duration"):
+            if isinstance(message.get(key), (int, float)):
+                current[key] = float(message[key])
+        self.set_profile(PostureProfile(**current))
+        if message.get("id"):
+            self.assign_user(str(message["id"]), user)
+        return {"ok": True, "profile": current}
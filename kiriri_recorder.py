@@ -0,0 +1,271 @@
+"""
+セッション記録 - 受信サンプルを列指向のバイナリファイルに追記する
+
+ファイル形式（リトルエンディアン）:
+    ファイルヘッダー: magic "KRREC001", version u16, device_id 32バイト, 開始時刻 f64
+    ブロック（バッチごとに追記）:
+        ブロックヘッダー: magic "KBLK", 件数 u32, 基準時刻 f64
+        時刻オフセット列: u32 × 件数（基準時刻からのマイクロ秒）
+        y列: i16 × 件数（1/100 度）
+        x列: i16 × 件数（1/100 度）
+
+1サンプルあたり 8 バイト。読み込みは mmap 上のゼロコピーな NumPy ビューで行う。
+"""
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 読み込み（read_recording）と extend にのみ必要
+    np = None
+
+FILE_MAGIC = b"KRREC001"
+FILE_VERSION = 1
+BLOCK_MAGIC = b"KBLK"
+FILE_EXTENSION = ".krec"
+
+FILE_HEADER = struct.Struct("<8sH32sd")
+BLOCK_HEADER = struct.Struct("<4sId")
+
+# 1ブロックの時刻オフセットは u32 マイクロ秒（約71分）に収める
+MAX_BLOCK_SPAN = 3600.0
+INT16_MIN, INT16_MAX = -32768, 32767
+
+def _clip16(value: int) -> int:
+    return INT16_MIN if value < INT16_MIN else INT16_MAX if value > INT16_MAX else value
+
+# ================== 書き込み ==================
+class SessionRecorder:
+    """1デバイス・1セッション分の記録ファイル（サイズ・時間でローテーション）"""
+
+    def __init__(self, directory: str, device_id: str, batch_size: int = 256,
+                 flush_interval: float = 1.0, rotate_bytes: int = 64 * 1024 * 1024,
+                 rotate_seconds: float = 3600.0):
+        self.directory = os.path.join(directory, device_id)
+        self.device_id = device_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+
+        self.session = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.sequence = 0
+        self.path: Optional[str] = None
+        self.samples_written = 0
+
+        self._file = None
+        self._file_started = 0.0
+        self._file_size = 0
+
+        # 書き込み待ちのバッチ
+        self._base_time = 0.0
+        self._batch_started = 0.0
+        self._offsets = array("I")
+        self._y = array("h")
+        self._x = array("h")
+
+    def append(self, timestamp: float, y: int, x: int):
+        """1サンプル追加（バッチが溜まったら書き込む）"""
+        if not self._offsets:
+            self._base_time = timestamp
+            self._batch_started = time.monotonic()
+        elif timestamp - self._base_time >= MAX_BLOCK_SPAN or timestamp < self._base_time:
+            self.flush()
+            self._base_time = timestamp
+            self._batch_started = time.monotonic()
+
+        self._offsets.append(int((timestamp - self._base_time) * 1_000_000))
+        self._y.append(_clip16(y))
+        self._x.append(_clip16(x))
+
+        if len(self._offsets) >= self.batch_size:
+            self.flush()
+
+    def flush_due(self):
+        """flush_interval を過ぎたバッチを書き込む"""
+        if self._offsets and time.monotonic() - self._batch_started >= self.flush_interval:
+            self.flush()
+
+    def extend(self, timestamps, y, x):
+        """NumPy 配列をまとめて追記する（ログ取り込み用。batch_size ごとに1ブロック）"""
+        self.flush()
+        for start in range(0, len(timestamps), self.batch_size):
+            t = timestamps[start:start + self.batch_size]
+            base_time = float(t[0])
+            offsets = t - base_time
+            if offsets.min() < 0 or offsets.max() >= MAX_BLOCK_SPAN:
+                # 時刻が戻る・間が空きすぎるブロックは1サンプルずつ
+                for i in range(len(t)):
+                    self.append(float(t[i]), int(y[start + i]), int(x[start + i]))
+                self.flush()
+                continue
+            self._write_block(
+                len(t), base_time,
+                (offsets * 1_000_000).astype("<u4"),
+                np.clip(y[start:start + self.batch_size], INT16_MIN, INT16_MAX).astype("<i2"),
+                np.clip(x[start:start + self.batch_size], INT16_MIN, INT16_MAX).astype("<i2"),
+            )
+
+    def flush(self):
+        """バッチを1ブロックとして書き込む"""
+        count = len(self._offsets)
+        if count == 0:
+            return
+
+        self._write_block(count, self._base_time, self._offsets, self._y, self._x)
+        del self._offsets[:]
+        del self._y[:]
+        del self._x[:]
+
+    def _write_block(self, count: int, base_time: float, offsets, y, x):
+        if self._file is None or self._should_rotate():
+            self._open_next()
+
+        block = b"".join((
+            BLOCK_HEADER.pack(BLOCK_MAGIC, count, base_time),
+            offsets.tobytes(),
+            y.tobytes(),
+            x.tobytes(),
+        ))
+        self._file.write(block)
+        self._file.flush()
+        self._file_size += len(block)
+        self.samples_written += count
+
+    def close(self):
+        """残りを書き込んで閉じる"""
+        self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _should_rotate(self) -> bool:
+        if self.rotate_bytes > 0 and self._file_size >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds > 0 and time.monotonic() - self._file_started >= self.rotate_seconds:
+            return True
+        return False
+
+    def _open_next(self):
+        """次のファイルを開く（ローテーション）"""
+        if self._file:
+            self._file.close()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.sequence += 1
+        self.path = os.path.join(
+            self.directory,
+            f"{self.device_id}_{self.session}_{self.sequence:03d}{FILE_EXTENSION}"
+        )
+        self._file = open(self.path, "wb")
+        header = FILE_HEADER.pack(
+            FILE_MAGIC, FILE_VERSION, self.device_id.encode("utf-8")[:32], time.time()
+        )
+        self._file.write(header)
+        self._file_started = time.monotonic()
+        self._file_size = len(header)
+
+class SampleRecorder:
+    """デバイスごとに SessionRecorder を振り分ける記録シンク"""
+
+    def __init__(self, directory: str, batch_size: int = 256, flush_interval: float = 1.0,
+                 rotate_bytes: int = 64 * 1024 * 1024, rotate_seconds: float = 3600.0):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.sessions: Dict[str, SessionRecorder] = {}
+
+    def write(self, sample):
+        """1サンプルを記録（Sample 互換: device_id, y, x, timestamp）"""
+        session = self.sessions.get(sample.device_id)
+        if session is None:
+            session = SessionRecorder(
+                self.directory, sample.device_id, self.batch_size,
+                self.flush_interval, self.rotate_bytes, self.rotate_seconds
+            )
+            self.sessions[sample.device_id] = session
+        session.append(sample.timestamp, sample.y, sample.x)
+
+    async def run(self):
+        """サンプルが途切れても flush_interval ごとに書き込む"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for session in self.sessions.values():
+                session.flush_due()
+
+    def close(self):
+        """全セッションを閉じる"""
+        for session in self.sessions.values():
+            session.close()
+
+# ================== 読み込み ==================
+def read_header(path: str) -> Tuple[str, float]:
+    """ファイルヘッダーから (device_id, 開始時刻) を読む"""
+    with open(path, "rb") as f:
+        raw = f.read(FILE_HEADER.size)
+    magic, version, device_id, started = FILE_HEADER.unpack(raw)
+    if magic != FILE_MAGIC:
+        raise ValueError(f"記録ファイルではありません: {path}")
+    return device_id.rstrip(b"\0").decode("utf-8"), started
+
+def iter_blocks(buffer) -> Iterator[Tuple[float, "np.ndarray", "np.ndarray", "np.ndarray"]]:
+    """(基準時刻, オフセット, y, x) をブロックごとに返す（buffer 上のゼロコピービュー）"""
+    if np is None:
+        raise ImportError("記録ファイルの読み込みには numpy が必要です")
+
+    position = FILE_HEADER.size
+    end = len(buffer)
+    while position + BLOCK_HEADER.size <= end:
+        magic, count, base_time = BLOCK_HEADER.unpack_from(buffer, position)
+        body = position + BLOCK_HEADER.size
+        if magic != BLOCK_MAGIC or body + count * 8 > end:
+            break  # 書き込み途中のブロック
+        offsets = np.frombuffer(buffer, dtype="<u4", count=count, offset=body)
+        y = np.frombuffer(buffer, dtype="<i2", count=count, offset=body + count * 4)
+        x = np.frombuffer(buffer, dtype="<i2", count=count, offset=body + count * 6)
+        yield base_time, offsets, y, x
+        position = body + count * 8
+
+class Recording:
+    """mmap で開いた記録ファイル"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.device_id, self.started = read_header(path)
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def blocks(self):
+        """ブロックごとのゼロコピービュー"""
+        return iter_blocks(self._mmap)
+
+    def arrays(self):
+        """全ブロックを連結して (timestamps f64, y i16, x i16) を返す"""
+        parts = [(base + offsets * 1e-6, y, x) for base, offsets, y, x in self.blocks()]
+        if not parts:
+            return np.empty(0), np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16)
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_recording(path: str):
+    """記録ファイルを (timestamps, y, x) の配列として読み込む"""
+    with Recording(path) as recording:
+        return recording.arrays()
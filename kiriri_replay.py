@@ -0,0 +1,180 @@
+"""
+記録済みセッションの再生 - 保存したデータを BLESensorConnection にそのまま流し込む
+
+ReplayTransport を BLESensorConnection / BLESensorManager に渡すと、仮想センサーが
+ログ（ble_sensor_service.log の「受信データ」行）や記録ファイル（.krec）の内容を
+受信間隔どおりに通知する。handle_notification → コールバック → WebSocket の経路を
+実機なしで再現・計測できる。速度は 1 倍、N 倍、または 0（待たずに最速）。
+
+    python kiriri_replay.py ble_sensor_service.log --speed 1 --websocket
+    python kiriri_replay.py records/KIRIRI01/*.krec --speed 0
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import List, Sequence
+
+from kiriri_bridge import (
+    BLESensorManager, WebSocketServer, data_handler, setup_logger, stop_logger
+)
+from kiriri_recorder import FILE_EXTENSION, read_header, read_recording
+from kiriri_sim import SimulatedClient, SimulatedPeripheral, SimulatedTransport, simulation_config
+
+# 「受信データ [時刻]: N:<y>:<x>」の行（ログ出力の間引き前の形式も含む）
+_LOG_PATTERN = re.compile(
+    r"受信データ \[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\]: N:(-?\d+):(-?\d+)".encode("utf-8")
+)
+
+# 最速再生でイベントループに戻るまでの通知数
+MAX_SPEED_BURST = 100
+
+# ================== 再生データ ==================
+@dataclass
+class ReplayPeripheral(SimulatedPeripheral):
+    """記録されたサンプル列を通知する仮想センサー"""
+    timestamps: Sequence[float] = field(default_factory=list)
+    y: Sequence[int] = field(default_factory=list)
+    x: Sequence[int] = field(default_factory=list)
+    speed: float = 1.0   # 再生速度（0 = 待たずに最速）
+    loop: bool = False   # 最後まで再生したら先頭に戻る
+    source: str = ""
+
+    position: int = field(default=0, init=False)
+    finished: asyncio.Event = field(default_factory=asyncio.Event, init=False, repr=False)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def duration(self) -> float:
+        return self.timestamps[-1] - self.timestamps[0] if len(self.timestamps) > 1 else 0.0
+
+def load_log(path: str):
+    """ログから (timestamps, y, x) を読む（ログにはデバイス名がないため1台分として扱う）"""
+    timestamps, ys, xs = [], [], []
+    with open(path, "rb") as f:
+        for line in f:
+            match = _LOG_PATTERN.search(line)
+            if match is None:
+                continue
+            stamp = datetime.strptime(match.group(1).decode(), "%Y-%m-%d %H:%M:%S.%f")
+            timestamps.append(stamp.timestamp())
+            ys.append(int(match.group(2)))
+            xs.append(int(match.group(3)))
+    return timestamps, ys, xs
+
+def load_sources(paths: List[str], speed: float = 1.0, loop: bool = False) -> List[ReplayPeripheral]:
+    """ログ・記録ファイルごとに ReplayPeripheral を作る"""
+    peripherals = []
+    for i, path in enumerate(paths):
+        if path.endswith(FILE_EXTENSION):
+            device_id, _ = read_header(path)
+            timestamps, y, x = (column.tolist() for column in read_recording(path))
+            name = f"{device_id}-REPLAY-{i + 1:02d}"
+        else:
+            timestamps, y, x = load_log(path)
+            name = f"KIRIRI-REPLAY-{i + 1:02d}"
+        peripherals.append(ReplayPeripheral(
+            name=name,
+            address=f"RE:PL:AY:00:{(i >> 8) & 0xFF:02X}:{i & 0xFF:02X}",
+            advertise_delay=0.0,
+            connect_latency=0.0,
+            timestamps=timestamps, y=y, x=x,
+            speed=speed, loop=loop, source=os.path.basename(path),
+        ))
+    return peripherals
+
+# ================== トランスポート ==================
+class ReplayClient(SimulatedClient):
+    """記録どおりの間隔で通知する BleakClient 互換クライアント"""
+
+    async def _emit(self):
+        peripheral: ReplayPeripheral = self.peripheral
+        timestamps = peripheral.timestamps
+        loop = asyncio.get_running_loop()
+
+        while self.is_connected:
+            if peripheral.position >= len(timestamps):
+                if not peripheral.loop:
+                    peripheral.finished.set()
+                    return
+                peripheral.position = 0
+
+            # 再接続・先頭に戻ったときはそこから時刻を合わせ直す
+            started = loop.time()
+            first = peripheral.position
+            origin = timestamps[first]
+            for i in range(first, len(timestamps)):
+                if peripheral.speed > 0:
+                    delay = started + (timestamps[i] - origin) / peripheral.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif (i - first) % MAX_SPEED_BURST == 0:
+                    await asyncio.sleep(0)
+                if not (self.is_connected and self._notify_callback):
+                    return
+                peripheral.position = i + 1
+                peripheral.notifications_sent += 1
+                self._notify_callback(
+                    self._notify_char, bytearray(b"N:%d:%d\r\n" % (peripheral.y[i], peripheral.x[i]))
+                )
+
+class ReplayTransport(SimulatedTransport):
+    """記録済みセッションを再生するトランスポート（BleakTransport と同じインターフェース）"""
+
+    def create_client(self, device, **kwargs) -> ReplayClient:
+        return ReplayClient(self, device, **kwargs)
+
+# ================== メイン ==================
+async def main():
+    parser = argparse.ArgumentParser(description="記録済みセッションの再生")
+    parser.add_argument("paths", nargs="+", help="ログ (ble_sensor_service.log) または記録ファイル (.krec)")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（1 = 実時間、0 = 最速）")
+    parser.add_argument("--loop", action="store_true", help="繰り返し再生する")
+    parser.add_argument("--websocket", action="store_true", help="WebSocketで配信する（pairing_test.js から見られる）")
+    args = parser.parse_args()
+
+    peripherals = [p for p in load_sources(args.paths, args.speed, args.loop) if len(p)]
+    if not peripherals:
+        parser.error("再生できるサンプルがありません")
+    # 記録中の途絶えをそのまま再現するため、無通信での切断・品質低下での再接続はしない
+    config = simulation_config(
+        peripherals, websocket_enabled=args.websocket, log_level="INFO",
+        keepalive_stall_intervals=0, link_health_min_score=0.0
+    )
+    logger = setup_logger(config)
+    for p in peripherals:
+        logger.info(f"再生: {p.source} → {p.name} ({len(p)} サンプル, {p.duration:.1f} 秒)")
+
+    sinks = []
+    server = WebSocketServer(config)
+    if config.websocket_enabled:
+        await server.start()
+        sinks.append(server.publish)
+
+    manager = BLESensorManager(
+        config, data_callback=partial(data_handler, sinks), transport=ReplayTransport(config, peripherals)
+    )
+    started = time.perf_counter()
+    task = asyncio.create_task(manager.run())
+    try:
+        await asyncio.gather(*(p.finished.wait() for p in peripherals))
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = manager.stats
+        await manager.stop()
+        await server.stop()
+        task.cancel()
+
+    received = sum(s["data_received"] for s in stats.values())
+    logger.info(f"再生完了: {received} サンプル / {elapsed:.2f} 秒 ({received / elapsed:.0f} サンプル/秒)")
+    stop_logger()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,272 @@
+"""
+共有メモリのサンプルリング - プロセス間でサンプルを pickle せずに受け渡す
+
+SharedSampleRing はワーカープロセスから集約側への転送（kiriri_supervisor.py）と、
+同じホストのほかのプロセスに向けたデバイスごとのサンプルバス（SampleBus）に使う。
+
+    python kiriri_shm.py KIRIRI01    # バスを読んで受信レートと遅延を表示
+
+書き込みは1プロセス（単一ライター）、読み込みは何プロセスでもよい。読み手はそれぞれ
+自分のシーケンス番号を持ち、追いつけずに上書きされた分は lost として数える。
+
+メモリ配置（リトルエンディアン）:
+    ヘッダー 64 バイト: magic "KRRING01", capacity u32, name_slots u32,
+                        write_seq u64（書き込み済みの件数）, device_count u32
+    デバイス名表: name_slots × 32 バイト（UTF-8、ゼロ埋め）
+    スロット: capacity × 32 バイト
+        seq u64（そのスロットのシーケンス番号 + 1、書き込み中は 0）, timestamp f64,
+        y i32, x i32, デバイス番号 u32, 予備 u32
+
+スロットはシーケンスロック方式で、ライターは seq を 0 にしてから中身を書き、最後に
+seq を設定する。読み手はコピーの前後で seq が期待値のままのスロットだけを採用する。
+"""
+
+import os
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+RING_MAGIC = b"KRRING01"
+RING_HEADER = struct.Struct("<8sII")
+HEADER_SIZE = 64
+WRITE_SEQ_OFFSET = 16
+DEVICE_COUNT_OFFSET = 24
+NAME_SIZE = 32
+
+SLOT = struct.Struct("<QdiiII")
+SLOT_DTYPE = np.dtype([
+    ("seq", "<u8"), ("timestamp", "<f8"), ("y", "<i4"), ("x", "<i4"),
+    ("device", "<u4"), ("reserved", "<u4"),
+])
+_U64 = struct.Struct("<Q")
+_U32 = struct.Struct("<I")
+
+def _open_shared_memory(name: Optional[str], create: bool, size: int = 0) -> shared_memory.SharedMemory:
+    """リソーストラッカーに管理させずに開く（後片付けは作成側の unlink で行う）
+
+    トラッカーに任せると、読み手のプロセスが終了したときに共有メモリが消されてしまう。
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:  # Python 3.12 以前
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        if os.name == "posix":
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _unlink_shared_memory(shm: shared_memory.SharedMemory):
+    if os.name == "posix" and getattr(shm, "_track", True):
+        # unlink() が登録解除するので、開いたときに外した登録を戻しておく
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+class SharedSampleRing:
+    """共有メモリ上のサンプルリングバッファ（単一ライター・複数リーダー）"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+
+        magic, self.capacity, self.name_slots = RING_HEADER.unpack_from(shm.buf, 0)
+        if magic != RING_MAGIC:
+            shm.close()
+            raise ValueError(f"サンプルリングではありません: {shm.name}")
+        self._slots_offset = HEADER_SIZE + self.name_slots * NAME_SIZE
+        self.slots = np.ndarray(
+            (self.capacity,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=self._slots_offset
+        )
+
+        # リーダー側
+        self.read_seq = self.write_seq
+        self.lost = 0
+        self._device_names: List[str] = []
+        # ライター側（書き直すライターは続きから書き、登録済みのデバイス番号を引き継ぐ）
+        self._write_seq = self.read_seq
+        device_count = _U32.unpack_from(shm.buf, DEVICE_COUNT_OFFSET)[0]
+        self._device_index: Dict[str, int] = {self.device_name(i): i for i in range(device_count)}
+
+    @classmethod
+    def create(cls, name: Optional[str] = None, capacity: int = 65536,
+               name_slots: int = 64) -> "SharedSampleRing":
+        """リングを作成する（作成したプロセスが close で共有メモリを削除する）"""
+        size = HEADER_SIZE + name_slots * NAME_SIZE + capacity * SLOT.size
+        shm = _open_shared_memory(name, create=True, size=size)
+        shm.buf[:HEADER_SIZE + name_slots * NAME_SIZE] = bytes(HEADER_SIZE + name_slots * NAME_SIZE)
+        RING_HEADER.pack_into(shm.buf, 0, RING_MAGIC, capacity, name_slots)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedSampleRing":
+        """既存のリングを名前で開く（読み込みは現在位置から始まる）"""
+        return cls(_open_shared_memory(name, create=False), owner=False)
+
+    @property
+    def write_seq(self) -> int:
+        return _U64.unpack_from(self.shm.buf, WRITE_SEQ_OFFSET)[0]
+
+    # ---------- 書き込み ----------
+    def write(self, sample):
+        """1サンプル書き込む（Sample 互換: device_id, y, x, timestamp）"""
+        index = self._device_index.get(sample.device_id)
+        if index is None:
+            index = self._register_device(sample.device_id)
+
+        seq = self._write_seq
+        buf = self.shm.buf
+        offset = self._slots_offset + (seq % self.capacity) * SLOT.size
+        # seq = 0（書き込み中）で中身を書き、最後に seq を入れる
+        SLOT.pack_into(buf, offset, 0, sample.timestamp, sample.y, sample.x, index, 0)
+        _U64.pack_into(buf, offset, seq + 1)
+
+        self._write_seq = seq + 1
+        _U64.pack_into(buf, WRITE_SEQ_OFFSET, seq + 1)
+
+    def _register_device(self, device_id: str) -> int:
+        count = _U32.unpack_from(self.shm.buf, DEVICE_COUNT_OFFSET)[0]
+        if count >= self.name_slots:
+            raise ValueError(f"デバイス名表が一杯です（{self.name_slots} 台）")
+        encoded = device_id.encode("utf-8")[:NAME_SIZE]
+        start = HEADER_SIZE + count * NAME_SIZE
+        self.shm.buf[start:start + NAME_SIZE] = encoded.ljust(NAME_SIZE, b"\0")
+        _U32.pack_into(self.shm.buf, DEVICE_COUNT_OFFSET, count + 1)
+        self._device_index[device_id] = count
+        return count
+
+    # ---------- 読み込み ----------
+    def device_name(self, index: int) -> str:
+        """デバイス番号からデバイス名"""
+        while index >= len(self._device_names):
+            start = HEADER_SIZE + len(self._device_names) * NAME_SIZE
+            raw = bytes(self.shm.buf[start:start + NAME_SIZE])
+            self._device_names.append(raw.rstrip(b"\0").decode("utf-8", errors="replace"))
+        return self._device_names[index]
+
+    def read(self, max_items: Optional[int] = None) -> np.ndarray:
+        """前回の続きから読めるだけ読む（SLOT_DTYPE の配列、上書きされた分は lost に数える）"""
+        end = self.write_seq
+        start = self.read_seq
+        if end - start > self.capacity:
+            self.lost += end - self.capacity - start
+            start = end - self.capacity
+        if max_items is not None:
+            end = min(end, start + max_items)
+        if end <= start:
+            return self.slots[:0].copy()
+
+        first = start % self.capacity
+        count = end - start
+        if first + count <= self.capacity:
+            indices = slice(first, first + count)
+        else:
+            indices = np.r_[first:self.capacity, 0:first + count - self.capacity]
+        records = self.slots[indices].copy()
+
+        # コピー中に上書きされたスロットを除く
+        expected = np.arange(start + 1, end + 1, dtype=np.uint64)
+        valid = (records["seq"] == expected) & (self.slots["seq"][indices] == expected)
+        self.read_seq = end
+        if not valid.all():
+            self.lost += int(count - valid.sum())
+            records = records[valid]
+        return records
+
+    def samples(self, max_items: Optional[int] = None) -> Iterator[Tuple[str, int, int, float]]:
+        """read() の結果を (device_id, y, x, timestamp) で返す"""
+        records = self.read(max_items)
+        names = [self.device_name(i) for i in range(int(records["device"].max()) + 1)] if len(records) else []
+        for device, y, x, timestamp in zip(
+            records["device"].tolist(), records["y"].tolist(),
+            records["x"].tolist(), records["timestamp"].tolist()
+        ):
+            yield names[device], y, x, timestamp
+
+    def close(self):
+        """閉じる（作成側は共有メモリも削除する）"""
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            try:
+                _unlink_shared_memory(self.shm)
+            except FileNotFoundError:
+                pass
+
+# ================== デバイスごとのサンプルバス ==================
+def bus_ring_name(device_id: str, prefix: str = "kiriri") -> str:
+    """デバイスのリング名（同じホストの読み手はこの名前で attach する）"""
+    return f"{prefix}-" + "".join(c if c.isalnum() or c in "-_" else "_" for c in device_id)
+
+class SampleBus:
+    """受信サンプルをデバイスごとの共有メモリリングに書くシンク
+
+    読み手は SharedSampleRing.attach(bus_ring_name(device_id)) で開き、read() で続きを読む。
+    ブリッジが前回異常終了して同名のリングが残っていれば、それを引き継いで書き続ける。
+    """
+
+    def __init__(self, prefix: str = "kiriri", capacity: int = 65536):
+        self.prefix = prefix
+        self.capacity = capacity
+        self.rings: Dict[str, SharedSampleRing] = {}
+
+    def write(self, sample):
+        """1サンプル書き込む（Sample 互換: device_id, y, x, timestamp）"""
+        ring = self.rings.get(sample.device_id)
+        if ring is None:
+            ring = self._open(sample.device_id)
+        ring.write(sample)
+
+    def _open(self, device_id: str) -> SharedSampleRing:
+        name = bus_ring_name(device_id, self.prefix)
+        try:
+            ring = SharedSampleRing.create(name, self.capacity, name_slots=1)
+        except FileExistsError:
+            ring = SharedSampleRing.attach(name)
+            ring.owner = True
+        self.rings[device_id] = ring
+        return ring
+
+    def close(self):
+        """全リングを削除"""
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
+# ================== メイン ==================
+def main():
+    """バスを読んで受信レートと遅延を表示する（読み手の例）"""
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="共有メモリのサンプルバスを読む")
+    parser.add_argument("device", help="デバイス名（例: KIRIRI01）")
+    parser.add_argument("--prefix", default="kiriri")
+    parser.add_argument("--interval", type=float, default=0.001, help="ポーリング間隔（秒）")
+    args = parser.parse_args()
+
+    ring = SharedSampleRing.attach(bus_ring_name(args.device, args.prefix))
+    count = 0
+    latency = 0.0
+    reported = time.monotonic()
+    try:
+        while True:
+            records = ring.read()
+            if len(records):
+                count += len(records)
+                latency = time.time() - float(records["timestamp"][-1])
+                last = records[-1]
+            now = time.monotonic()
+            if now - reported >= 1.0 and count:
+                print(f"{count / (now - reported):.0f} サンプル/秒, 遅延 {latency * 1e6:.0f} µs, "
+                      f"y {last['y'] / 100:.2f} x {last['x'] / 100:.2f}, 取りこぼし {ring.lost}")
+                count = 0
+                reported = now
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+KIRIRI センサーのシミュレーター - 実機・Bluetoothアダプターなしで BLESensorConnection を動かす
+
+SimulatedTransport を BLESensorConnection / BLESensorManager に渡すと、
+BleakScanner / BleakClient の代わりにプロセス内の仮想ペリフェラルが使われる。
+通知レート・ジッター・切断パターン・GATTエラーを設定でき、乱数はシードで固定される。
+
+    python kiriri_sim.py --sensors 100 --rate 50 --duration 30
+"""
+
+import argparse
+import asyncio
+import math
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from bleak import BleakError
+
+from kiriri_bridge import BLEConfig, BLESensorManager, setup_logger, stop_logger
+
+KIRIRI_SERVICE_UUID = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"
+
+# ================== 仮想ペリフェラル ==================
+@dataclass
+class SimulatedPeripheral:
+    """仮想KIRIRIセンサーの振る舞い"""
+    name: str
+    address: str
+    rate_hz: float = 50.0                # 通知レート
+    jitter: float = 0.0                  # 通知間隔の揺らぎ（間隔に対する割合 0〜1）
+    rssi: int = -60
+    advertise_delay: float = 0.1         # スキャン開始からアドバタイズが届くまでの最大時間
+    connect_latency: float = 0.05        # 接続にかかる時間
+    link_lifetime: Optional[float] = None  # 平均接続維持時間（指数分布、None = 切断しない）
+    downtime: float = 0.0                # 切断後に見えなくなる時間
+    gatt_error_rate: float = 0.0         # 接続・通知設定・書き込みごとのGATTエラー確率
+    seed: int = 0
+
+    # 姿勢の波形（1/100 度）
+    y_offset: int = 0
+    x_offset: int = 0
+    amplitude: int = 800
+    period: float = 10.0
+
+    rng: random.Random = field(init=False, repr=False)
+    available_at: float = field(default=0.0, init=False)
+    notifications_sent: int = field(default=0, init=False)
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+
+    def payload(self, t: float) -> bytearray:
+        """時刻 t の通知ペイロード N:<y>:<x>"""
+        phase = 2 * math.pi * t / self.period
+        y = self.y_offset + int(self.amplitude * math.sin(phase))
+        x = self.x_offset + int(self.amplitude * 0.5 * math.cos(phase))
+        return bytearray(f"N:{y}:{x}\r\n".encode())
+
+    def next_interval(self) -> float:
+        interval = 1.0 / self.rate_hz
+        if self.jitter:
+            interval *= 1.0 + self.rng.uniform(-self.jitter, self.jitter)
+        return max(interval, 0.0)
+
+    def maybe_gatt_error(self, operation: str):
+        """設定した確率でGATTエラーを発生させる"""
+        if self.gatt_error_rate and self.rng.random() < self.gatt_error_rate:
+            raise BleakError(f"GATT error (simulated {operation}): 0x85")
+
+@dataclass
+class SimulatedAdvertisement:
+    """AdvertisementData 互換"""
+    local_name: str
+    rssi: int
+    service_uuids: List[str] = field(default_factory=lambda: [KIRIRI_SERVICE_UUID])
+    manufacturer_data: Dict[int, bytes] = field(default_factory=dict)
+
+# ================== GATT ==================
+class SimulatedCharacteristic:
+    """BleakGATTCharacteristic 互換"""
+
+    def __init__(self, uuid: str, handle: int, service_uuid: str, properties: List[str]):
+        self.uuid = uuid
+        self.handle = handle
+        self.service_uuid = service_uuid
+        self.properties = properties
+
+class SimulatedService:
+    """BleakGATTService 互換"""
+
+    def __init__(self, uuid: str, handle: int, characteristics: List[SimulatedCharacteristic]):
+        self.uuid = uuid
+        self.handle = handle
+        self.characteristics = characteristics
+
+class SimulatedServiceCollection:
+    """BleakGATTServiceCollection 互換（KIRIRIのUARTサービスのみ）"""
+
+    def __init__(self, config: BLEConfig):
+        write_char = SimulatedCharacteristic(
+            config.write_characteristic_uuid, 12, KIRIRI_SERVICE_UUID, ["write", "write-without-response"]
+        )
+        notify_char = SimulatedCharacteristic(
+            config.notify_characteristic_uuid, 14, KIRIRI_SERVICE_UUID, ["notify"]
+        )
+        service = SimulatedService(KIRIRI_SERVICE_UUID, 11, [write_char, notify_char])
+        self.services = {service.handle: service}
+        self.characteristics = {char.handle: char for char in service.characteristics}
+
+    def __iter__(self):
+        return iter(self.services.values())
+
+    def get_characteristic(self, specifier):
+        if isinstance(specifier, int):
+            return self.characteristics.get(specifier)
+        uuid = str(getattr(specifier, "uuid", specifier)).lower()
+        for char in self.characteristics.values():
+            if char.uuid == uuid:
+                return char
+        return None
+
+# ================== スキャナー・クライアント ==================
+class SimulatedScanner:
+    """BleakScanner 互換"""
+
+    def __init__(self, transport: "SimulatedTransport", detection_callback: Callable):
+        self.transport = transport
+        self.detection_callback = detection_callback
+        self._handles = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        for peripheral in self.transport.peripherals.values():
+            delay = max(peripheral.available_at - now, 0.0)
+            delay += peripheral.rng.uniform(0.0, peripheral.advertise_delay)
+            advertisement = SimulatedAdvertisement(peripheral.name, peripheral.rssi)
+            self._handles.append(
+                loop.call_later(delay, self.detection_callback, peripheral, advertisement)
+            )
+
+    async def stop(self):
+        for handle in self._handles:
+            handle.cancel()
+        self._handles.clear()
+
+class SimulatedClient:
+    """BleakClient 互換"""
+
+    def __init__(self, transport: "SimulatedTransport", device, timeout: float = 10.0,
+                 disconnected_callback: Optional[Callable] = None, **kwargs):
+        self.transport = transport
+        self.peripheral: SimulatedPeripheral = transport.peripherals[device.address]
+        self.address = device.address
+        self.timeout = timeout
+        self.disconnected_callback = disconnected_callback
+        self.services: Optional[SimulatedServiceCollection] = None
+        self.is_connected = False
+
+        self._notify_callback: Optional[Callable] = None
+        self._notify_char = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def connect(self, **kwargs) -> bool:
+        peripheral = self.peripheral
+        loop = asyncio.get_running_loop()
+
+        # 切断後しばらくは見えない（範囲外・電源断の再現）
+        if loop.time() < peripheral.available_at:
+            await asyncio.sleep(min(self.timeout, peripheral.available_at - loop.time()))
+            if loop.time() < peripheral.available_at:
+                raise asyncio.TimeoutError()
+
+        await asyncio.sleep(peripheral.connect_latency)
+        peripheral.maybe_gatt_error("connect")
+
+        self.services = SimulatedServiceCollection(self.transport.config)
+        self.is_connected = True
+
+        if peripheral.link_lifetime:
+            lifetime = peripheral.rng.expovariate(1.0 / peripheral.link_lifetime)
+            self._tasks.append(asyncio.create_task(self._drop_after(lifetime)))
+        return True
+
+    async def disconnect(self) -> bool:
+        self._close(notify=True)
+        return True
+
+    def drop(self, downtime: float = 0.0):
+        """リンク断を即座に発生させる（ベンチマーク・テスト用）"""
+        loop = asyncio.get_running_loop()
+        self.peripheral.available_at = loop.time() + downtime
+        self._close(notify=True)
+
+    def stall(self):
+        """接続したまま通知だけを止める（無通信検知のテスト用）"""
+        self._notify_callback = None
+
+    async def start_notify(self, characteristic, callback: Callable, **kwargs):
+        self._require_connected()
+        self.peripheral.maybe_gatt_error("start_notify")
+        self._notify_char = self.services.get_characteristic(characteristic)
+        self._notify_callback = callback
+
+    async def stop_notify(self, characteristic):
+        self._notify_callback = None
+
+    async def write_gatt_char(self, characteristic, data, response: bool = None):
+        self._require_connected()
+        self.peripheral.maybe_gatt_error("write")
+        if bytes(data).startswith(b"START") and self._notify_callback:
+            self._tasks.append(asyncio.create_task(self._emit()))
+
+    def _require_connected(self):
+        if not self.is_connected:
+            raise BleakError("Not connected")
+
+    async def _emit(self):
+        """通知を送り続ける"""
+        peripheral = self.peripheral
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_time = started
+        while self.is_connected:
+            next_time += peripheral.next_interval()
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not (self.is_connected and self._notify_callback):
+                break
+            peripheral.notifications_sent += 1
+            self._notify_callback(self._notify_char, peripheral.payload(loop.time() - started))
+
+    async def _drop_after(self, lifetime: float):
+        """接続が突然切れる状況を再現"""
+        await asyncio.sleep(lifetime)
+        self.drop(self.peripheral.downtime)
+
+    def _close(self, notify: bool):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        self._notify_callback = None
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self._tasks.clear()
+        if notify and self.disconnected_callback:
+            self.disconnected_callback(self)
+
+class SimulatedTransport:
+    """仮想ペリフェラルを使うトランスポート（BleakTransport と同じインターフェース）"""
+
+    def __init__(self, config: BLEConfig, peripherals: List[SimulatedPeripheral]):
+        self.config = config
+        self.peripherals: Dict[str, SimulatedPeripheral] = {p.address: p for p in peripherals}
+
+    def create_scanner(self, detection_callback: Callable) -> SimulatedScanner:
+        return SimulatedScanner(self, detection_callback)
+
+    def create_client(self, device, **kwargs) -> SimulatedClient:
+        return SimulatedClient(self, device, **kwargs)
+
+def make_peripherals(count: int, rate_hz: float = 50.0, seed: int = 0,
+                     **options) -> List[SimulatedPeripheral]:
+    """名前 KIRIRI-SIM-0001... の仮想センサーを count 台作る"""
+    return [
+        SimulatedPeripheral(
+            name=f"KIRIRI-SIM-{i + 1:04d}",
+            address=f"SI:M0:00:{(i >> 16) & 0xFF:02X}:{(i >> 8) & 0xFF:02X}:{i & 0xFF:02X}",
+            rate_hz=rate_hz,
+            seed=seed + i,
+            **options
+        )
+        for i in range(count)
+    ]
+
+def simulation_config(peripherals: List[SimulatedPeripheral], **overrides) -> BLEConfig:
+    """シミュレーション向けの設定（固定待機なし、全台同時接続）"""
+    options = dict(
+        target_device_names=[p.name for p in peripherals],
+        max_connections=len(peripherals),
+        scan_timeout=5.0,
+        reconnect_delay=1.0,
+        gatt_error_retry_delay=1.0,
+        keepalive_enabled=False,
+        websocket_enabled=False,
+        gatt_cache_file=None,
+        log_file=None,
+        log_level="WARNING",
+    )
+    options.update(overrides)
+    return BLEConfig(**options)
+
+# ================== メイン ==================
+async def main():
+    parser = argparse.ArgumentParser(description="KIRIRI センサーのシミュレーション")
+    parser.add_argument("--sensors", type=int, default=10, help="仮想センサー数")
+    parser.add_argument("--rate", type=float, default=50.0, help="通知レート (Hz)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="通知間隔の揺らぎ (0〜1)")
+    parser.add_argument("--link-lifetime", type=float, default=None, help="平均接続維持時間 (秒)")
+    parser.add_argument("--downtime", type=float, default=0.0, help="切断後に見えなくなる時間 (秒)")
+    parser.add_argument("--gatt-error-rate", type=float, default=0.0, help="GATTエラー確率")
+    parser.add_argument("--duration", type=float, default=10.0, help="実行時間 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    peripherals = make_peripherals(
+        args.sensors, rate_hz=args.rate, seed=args.seed, jitter=args.jitter,
+        link_lifetime=args.link_lifetime, downtime=args.downtime,
+        gatt_error_rate=args.gatt_error_rate
+    )
+    config = simulation_config(peripherals)
+    logger = setup_logger(config)
+    manager = BLESensorManager(config, transport=SimulatedTransport(config, peripherals))
+
+    task = asyncio.create_task(manager.run())
+    await asyncio.sleep(args.duration)
+    stats = manager.stats
+    await manager.stop()
+    task.cancel()
+
+    totals = {key: sum(s[key] for s in stats.values())
+              for key in ("connections", "disconnections", "data_received", "gatt_errors")}
+    sent = sum(p.notifications_sent for p in peripherals)
+    logger.warning(f"センサー {len(stats)}/{args.sensors} 台, 送信 {sent}, 集計 {totals}")
+    stop_logger()
+
+if __name__ == "__main__":
+    asyncio.run(main())
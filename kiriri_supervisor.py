@@ -0,0 +1,267 @@
+"""
+複数プロセスでの運用 - Bluetoothアダプター・デバイス群ごとにワーカープロセスを分ける
+
+各ワーカーは自分のイベントループで BLESensorManager を動かし、解析済みのサンプルを
+共有メモリのリング（kiriri_shm.SharedSampleRing）に書く。スーパーバイザーは
+リングを読んで1つの出力（WebSocket配信・姿勢判定・履歴・記録）にまとめ、
+落ちたワーカーを再起動する。サンプルは pickle もキューも通らない。
+
+    python kiriri_supervisor.py --worker hci0:KIRIRI01,KIRIRI02 --worker hci1:KIRIRI03
+    python kiriri_supervisor.py --simulate 200 --workers 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import platform
+import re
+import time
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Callable, List, Optional
+
+from kiriri_bridge import (
+    BLEConfig, BLESensorManager, BleakTransport, Sample, data_handler,
+    run_event_loop, setup_logger, setup_outputs, stop_logger
+)
+from kiriri_shm import SharedSampleRing
+
+@dataclass
+class WorkerSpec:
+    """1ワーカーの担当"""
+    name: str
+    devices: List[str]               # 担当するデバイス名
+    adapter: Optional[str] = None    # 例: "hci0"（None = 既定のアダプター）
+    simulate: bool = False           # 実機の代わりに kiriri_sim の仮想センサーを使う
+
+def worker_cache_file(path: Optional[str], worker_name: str) -> Optional[str]:
+    """ワーカーごとの GATT キャッシュファイル（例: kiriri_gatt_cache.hci0.json）
+    
+    GattCache は保存のたびにファイル全体を書き直すので、ワーカー間で共有すると互いの内容を消してしまう。
+    """
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^0-9A-Za-z_-]', '_', worker_name)}{ext or '.json'}"
+
+def run_worker(spec: WorkerSpec, config: BLEConfig, ring_name: str):
+    """ワーカープロセス本体：担当デバイスだけに接続してサンプルをリングに書く"""
+    config = replace(
+        config, target_device_names=spec.devices, max_connections=len(spec.devices),
+        gatt_cache_file=worker_cache_file(config.gatt_cache_file, spec.name)
+    )
+    ring = SharedSampleRing.attach(ring_name)
+
+    if spec.simulate:
+        from kiriri_sim import SimulatedPeripheral, SimulatedTransport
+        peripherals = [
+            SimulatedPeripheral(name=name, address=f"SI:M1:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}:00:00", seed=i)
+            for i, name in enumerate(spec.devices)
+        ]
+        transport = SimulatedTransport(config, peripherals)
+    else:
+        transport = BleakTransport(adapter=spec.adapter)
+
+    manager = BLESensorManager(
+        config, data_callback=partial(data_handler, [ring.write]), transport=transport
+    )
+    try:
+        run_event_loop(manager.run(), config)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        stop_logger()
+
+class WorkerHandle:
+    """スーパーバイザー側のワーカー管理（プロセスとリング）"""
+
+    def __init__(self, spec: WorkerSpec, ring: SharedSampleRing):
+        self.spec = spec
+        self.ring = ring
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.restarts = 0
+        self.samples = 0
+        self.restart_at: Optional[float] = None
+
+class Supervisor:
+    """ワーカープロセスを起動・監視し、リングのサンプルを sinks に渡す"""
+
+    def __init__(self, config: BLEConfig, specs: List[WorkerSpec], sinks: List[Callable]):
+        if config.callback_workers > 0:
+            # ワーカーのリングは単一ライターなので、スレッドプールから書き込めない
+            raise ValueError("callback_workers は 0 にしてください（ワーカーはリングにイベントループ上で書き込みます）")
+        for spec in specs:
+            if not spec.devices:
+                raise ValueError(f"ワーカー {spec.name} の担当デバイスがありません")
+        self.config = config
+        self.specs = specs
+        self.sinks = sinks
+        self.logger = setup_logger(config, "Supervisor")
+        self.workers: List[WorkerHandle] = []
+        self.should_stop = False
+        self._context = multiprocessing.get_context("spawn")
+
+    @property
+    def stats(self) -> dict:
+        """ワーカーごとの統計"""
+        return {
+            worker.spec.name: {
+                "pid": worker.process.pid if worker.process else None,
+                "alive": bool(worker.process and worker.process.is_alive()),
+                "restarts": worker.restarts,
+                "samples": worker.samples,
+                "lost": worker.ring.lost,
+            }
+            for worker in self.workers
+        }
+
+    def _start(self, worker: WorkerHandle):
+        worker.process = self._context.Process(
+            target=run_worker, args=(worker.spec, self.config, worker.ring.name),
+            name=f"kiriri-{worker.spec.name}", daemon=True
+        )
+        worker.process.start()
+        worker.restart_at = None
+        self.logger.info(
+            f"ワーカー起動: {worker.spec.name} (pid {worker.process.pid}, "
+            f"アダプター {worker.spec.adapter or '既定'}, {len(worker.spec.devices)} 台)"
+        )
+
+    def poll(self) -> int:
+        """全リングを読んで sinks に渡す（渡した件数）"""
+        total = 0
+        for worker in self.workers:
+            count = 0
+            for device_id, y, x, timestamp in worker.ring.samples():
+                sample = Sample(device_id, y, x, timestamp)
+                for sink in self.sinks:
+                    sink(sample)
+                count += 1
+            worker.samples += count
+            total += count
+        return total
+
+    def _check_workers(self):
+        """落ちたワーカーを worker_restart_delay 後に再起動"""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+            if worker.restart_at is None:
+                worker.restart_at = now + self.config.worker_restart_delay
+                self.logger.warning(
+                    f"ワーカー停止: {worker.spec.name} (終了コード {worker.process.exitcode})、"
+                    f"{self.config.worker_restart_delay} 秒後に再起動します"
+                )
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                self._start(worker)
+
+    async def run(self):
+        """ワーカーを起動してリングを読み続ける"""
+        for spec in self.specs:
+            # デバイス名表は担当デバイス数ぶん（ワーカーは max_connections = 担当数でしか接続しない）
+            ring = SharedSampleRing.create(
+                capacity=self.config.worker_ring_capacity, name_slots=len(spec.devices)
+            )
+            worker = WorkerHandle(spec, ring)
+            self.workers.append(worker)
+            self._start(worker)
+
+        try:
+            while not self.should_stop:
+                self.poll()
+                self._check_workers()
+                await asyncio.sleep(self.config.worker_poll_interval)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """全ワーカーを止めてリングを削除"""
+        self.should_stop = True
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                await loop.run_in_executor(None, worker.process.join, 5.0)
+        self.poll()  # 止まるまでに書かれた分
+        for worker in self.workers:
+            worker.ring.close()
+        self.workers.clear()
+
+# ================== メイン ==================
+def parse_worker(value: str, index: int) -> WorkerSpec:
+    """"hci0:KIRIRI01,KIRIRI02" または "KIRIRI01,KIRIRI02"（既定のアダプター）"""
+    adapter, _, devices = value.rpartition(":")
+    return WorkerSpec(
+        name=adapter or f"worker{index + 1}",
+        devices=[name for name in devices.split(",") if name],
+        adapter=adapter or None,
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="アダプター・デバイス群ごとのワーカープロセスで接続する")
+    parser.add_argument("--worker", action="append", default=[],
+                        help="アダプター:デバイス名,... （複数指定可、例: hci0:KIRIRI01,KIRIRI02）")
+    parser.add_argument("--simulate", type=int, default=0, help="仮想センサー数（実機の代わり）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="--simulate 時のワーカー数")
+    parser.add_argument("--duration", type=float, default=None, help="実行時間 (秒、省略時は停止まで)")
+    args = parser.parse_args()
+
+    if args.simulate:
+        names = [f"KIRIRI-SIM-{i + 1:04d}" for i in range(args.simulate)]
+        count = max(1, min(args.workers, len(names)))
+        specs = [
+            WorkerSpec(name=f"sim{i + 1}", devices=names[i::count], simulate=True)
+            for i in range(count)
+        ]
+        config = BLEConfig(
+            target_device_names=names, keepalive_enabled=False, gatt_cache_file=None,
+            reconnect_delay=1.0, log_file=None, log_level="WARNING"
+        )
+    else:
+        specs = [parse_worker(value, i) for i, value in enumerate(args.worker)]
+        if not specs:
+            parser.error("--worker か --simulate を指定してください")
+        config = BLEConfig(
+            target_device_names=[name for spec in specs for name in spec.devices],
+            max_reconnect_attempts=-1,
+            log_level="INFO"
+        )
+
+    logger = setup_logger(config)
+    server, sinks, background_tasks, closables = await setup_outputs(config)
+    supervisor = Supervisor(config, specs, sinks)
+
+    task = asyncio.create_task(supervisor.run())
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await task
+    except KeyboardInterrupt:
+        print("\n中断されました")
+    finally:
+        stats = supervisor.stats
+        await supervisor.stop()
+        task.cancel()
+        await server.stop()
+        for background in background_tasks:
+            background.cancel()
+        for closable in closables:
+            closable.close()
+
+    for name, worker_stats in stats.items():
+        logger.warning(f"{name}: {worker_stats}")
+    stop_logger()
+
+if __name__ == "__main__":
+    # Windows対応
+    if platform.system() == "Windows":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+
+    asyncio.run(main())
@@ -43,6 +43,8 @@ let currentY = 0.0;
 let currentX = 0.0;
 let isConnected = false;
 let isFeedbackActive = false;
+let lastPostureState = null; // ブリッジから最後に届いた姿勢判定（WebSocketモード）
+let calibratedDeviceId = null; // このページで基準を設定したセンサー（ほかのセンサーの判定は無視する）
 let isMeasuring = false;
 let connectionMode = 'ble'; // 'ble' または 'ws'
 
@@ -172,7 +174,8 @@ function updateAngleValues(y, x) {
         myPostureChart.update('none');
     }
 
-    if (isFeedbackActive) {
+    // WebSocketモードではブリッジが姿勢判定を行い、状態変化だけを送ってくる
+    if (isFeedbackActive && connectionMode !== 'ws') {
         checkPosture(currentY, currentX);
     }
 }
@@ -198,6 +201,13 @@ async function connectWebSocket() {
         webSocket.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
+                if (data.type === 'posture') {
+                    // ブリッジは全センサーの判定を全クライアントに送るので、自分のセンサー以外は捨てる
+                    if (data.id !== calibratedDeviceId) return;
+                    lastPostureState = data.state;
+                    if (isFeedbackActive) showPostureState(data.state);
+                    return;
+                }
                 if (typeof data.y === 'number' && typeof data.x === 'number') {
                     if (sensorIdDisplay && sensorIdDisplay.textContent !== data.id) {
                         sensorIdDisplay.textContent = data.id || 'Python Bridge';
@@ -318,6 +328,8 @@ async function handleDisconnect() {
     isConnected = false;
     isMeasuring = false;
     isFeedbackActive = false;
+    lastPostureState = null;
+    calibratedDeviceId = null;
     referenceY = null;
     referenceX = null;
     sensorIdDisplay.textContent = '---';
@@ -347,6 +359,12 @@ function calibratePosture() {
     referenceX = currentX;
     if (refYDisplay) refYDisplay.textContent = referenceY.toFixed(2);
     if (refXDisplay) refXDisplay.textContent = referenceX.toFixed(2);
+    // ブリッジ側の姿勢判定にも同じ基準を設定（新しい基準での判定が届くまで前の状態は使わない）
+    lastPostureState = null;
+    if (connectionMode === 'ws' && webSocket && webSocket.readyState === WebSocket.OPEN) {
+        calibratedDeviceId = sensorIdDisplay.textContent;
+        webSocket.send(JSON.stringify({ cmd: 'calibrate', id: calibratedDeviceId, y: referenceY, x: referenceX }));
+    }
     updateMessageDisplay("基準設定完了！「B. 計測開始」ボタンを押してください。", "success");
     isFeedbackActive = false;
     updateButtonStates();
@@ -401,9 +419,22 @@ function checkPosture(y, x) {
     if (referenceY === null) return;
     const diffY = y - referenceY;
     const diffX = x - referenceX;
-    if (Math.abs(diffY) < 5 && Math.abs(diffX) < 3) {
+    showPostureState(Math.abs(diffY) < 5 && Math.abs(diffX) < 3 ? 'good' : 'bad');
+}
+
+function enableFeedback() {
+    isFeedbackActive = true;
+    updateButtonStates();
+    // ブリッジは状態が変わったときしか送らないので、ON にした時点の状態をすぐ表示する
+    if (connectionMode === 'ws' && lastPostureState) {
+        showPostureState(lastPostureState);
+    }
+}
+
+function showPostureState(state) {
+    if (state === 'good') {
          updateMessageDisplay("良い姿勢です！", "success");
-    } else {
+    } else if (state === 'bad') {
          updateMessageDisplay("姿勢が崩れています。基準を意識しましょう。", "warning");
     }
 }
@@ -428,7 +459,7 @@ document.addEventListener('DOMContentLoaded', () => {
     calibrateButton.onclick = calibratePosture;
     startMeasurementButton.onclick = startMeasurement;
     endMeasurementButton.onclick = endMeasurement;
-    feedbackOnButton.onclick = () => { isFeedbackActive = true; updateButtonStates(); };
+    feedbackOnButton.onclick = enableFeedback;
     feedbackOffButton.onclick = () => { isFeedbackActive = false; updateButtonStates(); };
 
     connectModeSelect.addEventListener('change', (event) => {
@@ -0,0 +1,115 @@
+"""
+kiriri_bridge の単体テスト
+
+    python -m pytest -q
+"""
+
+import pytest
+
+from kiriri_bridge import (
+    FRAME_HEADER, MAX_FRAME_SPAN, BinaryFrameBuilder, LinkHealth, Sample, decode_frame
+)
+
+def feed(health: LinkHealth, deltas, start: float = 1000.0) -> float:
+    """受信間隔の列を順に与える（最後の受信時刻を返す）"""
+    now = start
+    health.update(now)
+    for delta in deltas:
+        now += delta
+        health.update(now)
+    return now
+
+# ================== LinkHealth ==================
+def test_link_health_short_first_delta_does_not_stick():
+    """最初の2件が連続して届いても、その後の 20 ms 間隔を欠落とみなさない"""
+    health = LinkHealth()
+    now = feed(health, [0.0005] + [0.020] * 499)
+    assert health.gaps == 0
+    assert health.loss < 0.01
+    assert abs(health.interval - 0.020) < 0.001
+    assert health.score(now) > 0.9
+
+def test_link_health_paired_notifications_score_perfect():
+    """2件ずつ（0 / 40 ms）届く健全なリンクは 20 ms 間隔・良好と判定する"""
+    health = LinkHealth()
+    now = feed(health, [0.0, 0.040] * 250)
+    assert health.gaps == 0
+    assert health.loss < 0.01
+    assert abs(health.interval - 0.020) < 0.001
+    assert health.score(now) > 0.95
+
+def test_link_health_recovers_from_low_seed():
+    """想定間隔が実際より短く決まっても、欠落扱いの間に追従して良好に戻る"""
+    health = LinkHealth(seed_events=1)
+    now = feed(health, [0.003] + [0.020] * 2000)
+    assert abs(health.interval - 0.020) < 0.001
+    assert health.loss < 0.05
+    assert health.score(now) > 0.9
+
+def test_link_health_counts_real_gaps():
+    """本当の欠落（20 ms 間隔の途中で 200 ms 途絶え）は数える"""
+    health = LinkHealth()
+    now = feed(health, [0.020] * 100 + [0.200] + [0.020] * 10)
+    assert health.gaps == 1
+    assert abs(health.longest_gap - 0.200) < 1e-9
+    assert health.loss > 0
+    assert health.score(now + 1.0) < 0.5
+
+# ================== バイナリフレーム ==================
+def test_binary_frame_round_trip():
+    """時刻はミリ秒（切り捨て）、角度は 1/100 度のまま戻る"""
+    builder = BinaryFrameBuilder("KIRIRI01", max_samples=100)
+    samples = [Sample("KIRIRI01", i * 7 - 300, -i * 3, 1000.0 + i * 0.0204) for i in range(50)]
+    for sample in samples:
+        assert builder.append(sample) is None
+    frame = builder.take()
+    assert builder.take() is None
+    assert len(frame) == FRAME_HEADER.size + len("KIRIRI01") + 6 * len(samples)
+
+    decoded = decode_frame(frame)
+    assert [(s.device_id, s.y, s.x) for s in decoded] == [(s.device_id, s.y, s.x) for s in samples]
+    for original, restored in zip(samples, decoded):
+        assert 0.0 <= original.timestamp - restored.timestamp < 0.001 + 1e-9
+
+def test_binary_frame_max_samples_boundary():
+    """max_samples 件で次のサンプルが来たときに完成したフレームを返す"""
+    builder = BinaryFrameBuilder("D", max_samples=3)
+    frames = [builder.append(Sample("D", i, i, 1000.0 + i * 0.01)) for i in range(7)]
+    assert frames[:3] == [None, None, None]
+    assert frames[3] is not None and frames[6] is not None
+    assert [s.y for s in decode_frame(frames[3])] == [0, 1, 2]
+    assert [s.y for s in decode_frame(frames[6])] == [3, 4, 5]
+    assert [s.y for s in decode_frame(builder.take())] == [6]
+
+def test_binary_frame_span_rollover():
+    """基準時刻から MAX_FRAME_SPAN 以上離れた・時刻が戻ったサンプルは次のフレームにする"""
+    builder = BinaryFrameBuilder("D", max_samples=1000)
+    assert builder.append(Sample("D", 1, 0, 1000.0)) is None
+    assert builder.append(Sample("D", 2, 0, 1000.0 + MAX_FRAME_SPAN - 0.001)) is None
+    frame = builder.append(Sample("D", 3, 0, 1000.0 + MAX_FRAME_SPAN))
+    decoded = decode_frame(frame)
+    assert [s.y for s in decoded] == [1, 2]
+    assert abs(decoded[1].timestamp - (1000.0 + MAX_FRAME_SPAN - 0.001)) < 0.001
+
+    frame = builder.append(Sample("D", 4, 0, 1000.0))  # 時刻が戻った
+    decoded = decode_frame(frame)
+    assert [s.y for s in decoded] == [3]
+    assert decoded[0].timestamp == 1000.0 + MAX_FRAME_SPAN
+    assert [s.timestamp for s in decode_frame(builder.take())] == [1000.0]
+
+def test_binary_frame_clamps_angles():
+    """int16 に収まらない角度は端の値にする"""
+    builder = BinaryFrameBuilder("D", max_samples=10)
+    for y, x in ((40000, -40000), (-32769, 32768), (32767, -32768)):
+        builder.append(Sample("D", y, x, 1000.0))
+    decoded = decode_frame(builder.take())
+    assert [(s.y, s.x) for s in decoded] == [(32767, -32768), (-32768, 32767), (32767, -32768)]
+
+def test_binary_frame_rejects_other_data():
+    """マジックが違うデータは ValueError"""
+    builder = BinaryFrameBuilder("D", 10)
+    builder.append(Sample("D", 0, 0, 0.0))
+    frame = bytearray(builder.take())
+    frame[0:2] = b"XX"
+    with pytest.raises(ValueError):
+        decode_frame(bytes(frame))
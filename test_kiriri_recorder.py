@@ -0,0 +1,80 @@
+"""
+kiriri_recorder（記録ファイル .krec）の単体テスト
+
+    python -m pytest -q
+"""
+
+import numpy as np
+
+from kiriri_recorder import (
+    BLOCK_HEADER, FILE_HEADER, MAX_BLOCK_SPAN, Recording, SessionRecorder,
+    iter_blocks, read_header, read_recording
+)
+
+def record(directory, samples, **options) -> SessionRecorder:
+    recorder = SessionRecorder(str(directory), "KIRIRI01", **options)
+    for timestamp, y, x in samples:
+        recorder.append(timestamp, y, x)
+    recorder.close()
+    return recorder
+
+def block_sizes(path) -> list:
+    with Recording(path) as recording:
+        return [len(offsets) for _, offsets, _, _ in recording.blocks()]
+
+def test_recorder_round_trip(tmp_path):
+    """書いたサンプルが読み戻せる（時刻はマイクロ秒、角度は int16 に丸める）"""
+    samples = [(1_700_000_000.0 + i * 0.02, i * 3 - 500, -i) for i in range(1000)]
+    samples.append((1_700_000_020.0, 40000, -40000))
+    recorder = record(tmp_path, samples, batch_size=64)
+
+    assert read_header(recorder.path)[0] == "KIRIRI01"
+    timestamps, y, x = read_recording(recorder.path)
+    assert len(timestamps) == len(samples) == recorder.samples_written
+    assert np.allclose(timestamps, [s[0] for s in samples], atol=2e-6)
+    assert y.tolist() == [s[1] for s in samples[:-1]] + [32767]
+    assert x.tolist() == [s[2] for s in samples[:-1]] + [-32768]
+    assert block_sizes(recorder.path) == [64] * 15 + [41]
+
+def test_recorder_rotates_by_size(tmp_path):
+    """rotate_bytes を超えたら次のファイルに書き、全ファイルを合わせると元に戻る"""
+    block_bytes = BLOCK_HEADER.size + 100 * 8
+    samples = [(1000.0 + i * 0.01, i % 300, 0) for i in range(1000)]
+    recorder = record(tmp_path, samples, batch_size=100, rotate_bytes=FILE_HEADER.size + 3 * block_bytes)
+
+    paths = sorted((tmp_path / "KIRIRI01").iterdir())
+    assert recorder.sequence == len(paths) == 4
+    assert [block_sizes(path) for path in paths] == [[100] * 3, [100] * 3, [100] * 3, [100]]
+    timestamps = np.concatenate([read_recording(path)[0] for path in paths])
+    assert np.allclose(timestamps, [s[0] for s in samples], atol=2e-6)
+
+def test_recorder_starts_new_block_on_long_span_or_time_going_back(tmp_path):
+    """基準時刻から MAX_BLOCK_SPAN 以上離れた・時刻が戻ったサンプルは新しいブロックにする"""
+    samples = [
+        (1000.0, 1, 0),
+        (1001.0, 2, 0),
+        (1000.0 + MAX_BLOCK_SPAN, 3, 0),   # 間が空きすぎ
+        (1000.0 + MAX_BLOCK_SPAN + 1, 4, 0),
+        (1500.0, 5, 0),                    # 時刻が戻った
+    ]
+    recorder = record(tmp_path, samples, batch_size=256)
+
+    assert block_sizes(recorder.path) == [2, 2, 1]
+    timestamps, y, _ = read_recording(recorder.path)
+    assert y.tolist() == [1, 2, 3, 4, 5]
+    assert np.allclose(timestamps, [s[0] for s in samples], atol=2e-6)
+
+def test_iter_blocks_stops_at_truncated_block(tmp_path):
+    """書き込み途中で切れた末尾のブロックは読まない"""
+    samples = [(1000.0 + i * 0.01, i, -i) for i in range(30)]
+    recorder = record(tmp_path, samples, batch_size=10)
+    data = open(recorder.path, "rb").read()
+
+    blocks = list(iter_blocks(data[:-5]))
+    assert [len(offsets) for _, offsets, _, _ in blocks] == [10, 10]
+    assert blocks[1][2].tolist() == list(range(10, 20))
+
+    # ブロックヘッダーの途中で切れていても同じ
+    last_block = len(data) - (BLOCK_HEADER.size + 10 * 8)
+    assert len(list(iter_blocks(data[:last_block + 3]))) == 2
+    assert len(list(iter_blocks(data))) == 3
@@ -0,0 +1,88 @@
+"""
+kiriri_shm（共有メモリのサンプルリング）の単体テスト
+
+    python -m pytest -q
+"""
+
+import uuid
+
+import pytest
+
+from kiriri_bridge import Sample
+from kiriri_shm import SampleBus, SharedSampleRing, bus_ring_name
+
+@pytest.fixture
+def ring():
+    ring = SharedSampleRing.create(f"kiriri-test-{uuid.uuid4().hex[:8]}", capacity=8, name_slots=4)
+    yield ring
+    ring.close()
+
+def write(ring, start: int, count: int, device: str = "D1"):
+    for i in range(start, start + count):
+        ring.write(Sample(device, i, -i, 1000.0 + i))
+
+def test_ring_read_across_wraparound(ring):
+    """末尾から先頭に折り返した分も順番どおりに読める"""
+    reader = SharedSampleRing.attach(ring.name)
+    try:
+        write(ring, 0, 6)
+        assert reader.read()["y"].tolist() == list(range(6))
+
+        write(ring, 6, 5, device="D2")   # スロット 6, 7, 0, 1, 2
+        assert list(reader.samples()) == [("D2", i, -i, 1000.0 + i) for i in range(6, 11)]
+        assert reader.lost == 0
+        assert len(reader.read()) == 0
+    finally:
+        reader.close()
+
+def test_ring_counts_lost_when_reader_falls_behind(ring):
+    """capacity を超えて遅れた分は lost に数え、残っている最新 capacity 件を読む"""
+    reader = SharedSampleRing.attach(ring.name)
+    try:
+        write(ring, 0, 20)
+        records = reader.read()
+        assert records["y"].tolist() == list(range(12, 20))
+        assert reader.lost == 12
+
+        write(ring, 20, 3)
+        assert reader.read(max_items=2)["y"].tolist() == [20, 21]
+        assert reader.read()["y"].tolist() == [22]
+        assert reader.lost == 12
+    finally:
+        reader.close()
+
+def test_ring_attach_starts_at_current_position(ring):
+    """あとから開いた読み手は書き込み済みの分を読まない"""
+    write(ring, 0, 5)
+    reader = SharedSampleRing.attach(ring.name)
+    try:
+        assert len(reader.read()) == 0
+        write(ring, 5, 1)
+        assert reader.read()["y"].tolist() == [5]
+    finally:
+        reader.close()
+
+def test_sample_bus_takes_over_leftover_ring():
+    """異常終了で残った同名のリングを引き継ぎ、続きから書いて close で削除する"""
+    prefix = f"kiriri-test-{uuid.uuid4().hex[:8]}"
+    name = bus_ring_name("KIRIRI01", prefix)
+    leftover = SharedSampleRing.create(name, capacity=16, name_slots=1)
+    leftover.write(Sample("KIRIRI01", 1, 1, 1000.0))
+    leftover.owner = False   # 前のブリッジが unlink せずに落ちた状態
+    leftover.close()
+
+    reader = SharedSampleRing.attach(name)
+    bus = SampleBus(prefix, capacity=16)
+    try:
+        bus.write(Sample("KIRIRI01", 2, 2, 1001.0))
+        ring = bus.rings["KIRIRI01"]
+        assert ring.owner
+        assert ring.write_seq == 2
+        assert list(reader.samples()) == [("KIRIRI01", 2, 2, 1001.0)]
+        assert reader.lost == 0
+    finally:
+        reader.close()
+        bus.close()
+
+    with pytest.raises(FileNotFoundError):
+        SharedSampleRing.attach(name)